@@ -0,0 +1,52 @@
+import os
+import time
+import hmac
+import hashlib
+import collections
+
+from . import const
+
+SALT_SIZE = 16
+
+def new_salt() -> bytes:
+    return os.urandom(SALT_SIZE)
+
+def derive(password: bytes, salt: bytes,
+        iterations: int = const.KDF_ITERATIONS) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+
+class CredentialCache(object):
+
+    def __init__(self, ttl: float = const.CREDENTIAL_TTL,
+            size: int = const.CREDENTIAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        # Name to a fast salted digest of the verified password and its expiry
+        # so that no password is kept in memory
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def digest(self, password: bytes, salt: bytes) -> bytes:
+        return hashlib.sha256(salt + password).digest()
+
+    def verified(self, name: str, password: bytes, salt: bytes) -> bool:
+        entry = self._entries.get(name)
+        if entry is None:
+            return False
+        digest, expires = entry
+        if expires < time.monotonic():
+            del self._entries[name]
+            return False
+        return hmac.compare_digest(digest, self.digest(password, salt))
+
+    def add(self, name: str, password: bytes, salt: bytes):
+        self._entries.pop(name, None)
+        self._entries[name] = (self.digest(password, salt),
+                time.monotonic() + self.ttl)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def discard(self, name: str):
+        self._entries.pop(name, None)
@@ -0,0 +1,137 @@
+import os
+import time
+import hmac
+import struct
+import hashlib
+import itertools
+import threading
+import collections
+from typing import Iterator, Optional, Tuple
+
+from .message import Message
+from . import const
+
+# Frames a connection received and sent, and when it opened and closed
+IN = 0
+OUT = 1
+OPEN = 2
+CLOSE = 3
+
+MAGIC = b'AIRCCAP1'
+# Connection id, unix time and direction, followed by the frame for IN and OUT
+RECORD = struct.Struct('!IdB')
+
+def redact(msg: Message, key: bytes) -> Message:
+    # Passwords are replaced by an HMAC of them under a key which is never
+    # written, so a replay still registers and proves names consistently
+    # yet the capture can not be used to guess them
+    if msg.handler != 'id_prove':
+        return msg
+    return Message(msg.handler, msg.header, hmac.new(key, msg.payload,
+        hashlib.sha256).hexdigest().encode(Message.ENCODING))
+
+def encode(key: bytes, conn_id: int, timestamp: float, direction: int,
+        msg: Optional[Message]) -> bytes:
+    record = RECORD.pack(conn_id, timestamp, direction)
+    if msg is None:
+        return record
+    return record + bytes(redact(msg, key))
+
+def read(data: bytes) -> Iterator[Tuple[int, float, int, Optional[Message]]]:
+    if not data.startswith(MAGIC):
+        raise ValueError('not a capture file')
+    offset = len(MAGIC)
+    while offset < len(data):
+        conn_id, timestamp, direction = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        msg = None
+        if direction in (IN, OUT):
+            lengths = Message.INITIAL.unpack_from(data, offset)
+            end = offset + Message.INITIAL.size + sum(lengths)
+            if end > len(data):
+                raise struct.error('record truncated at %d of %d bytes' % (
+                    len(data), end))
+            msg = next(Message.decode(data[offset:end]))
+            offset = end
+        yield conn_id, timestamp, direction, msg
+
+def load(path: str):
+    with open(path, 'rb') as fd:
+        return list(read(fd.read()))
+
+class Recorder(object):
+
+    __slots__ = ('capture', 'conn_id')
+
+    def __init__(self, capture, conn_id: int):
+        self.capture = capture
+        self.conn_id = conn_id
+
+    def record(self, direction: int, msg: Optional[Message] = None):
+        self.capture.record(self.conn_id, direction, msg)
+
+    def close(self):
+        self.record(CLOSE)
+
+class Capture(object):
+
+    def __init__(self, path: str,
+            flush_interval: float = const.CAPTURE_FLUSH_INTERVAL,
+            max_pending: int = const.CAPTURE_MAX_PENDING):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        # Random for every capture and only kept in memory
+        self._key = os.urandom(32)
+        self._conn_ids = itertools.count(1)
+        # Appended to on the loop, encoded and written by the writer thread
+        self._pending = collections.deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        # Holds every private and room message, only readable by this user
+        fileno = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fileno, 0o600)
+        self._fd = open(fileno, 'wb')
+        self._fd.write(MAGIC)
+        self._writer = threading.Thread(target=self.write, daemon=True)
+        self._writer.start()
+
+    def open(self) -> Recorder:
+        recorder = Recorder(self, next(self._conn_ids))
+        recorder.record(OPEN)
+        return recorder
+
+    def record(self, conn_id: int, direction: int,
+            msg: Optional[Message] = None):
+        # Records are dropped rather than let memory grow behind a slow disk
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((conn_id, time.time(), direction, msg))
+        if len(self._pending) == const.CAPTURE_BATCH:
+            self._wakeup.set()
+
+    def write(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        pending = self._pending
+        records = []
+        while pending:
+            records.append(encode(self._key, *pending.popleft()))
+        if records:
+            self._fd.write(b''.join(records))
+            self._fd.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self.flush()
+        self._fd.close()
@@ -3,10 +3,11 @@ import types
 import asyncio
 import inspect
 import argparse
+import collections
 from functools import wraps, partial
 
-from .server import Server
-from . import message, const
+from .server import Server, unix_address
+from . import message, const, loopback
 from .protocol import BaseProtocol
 
 async def must_id():
@@ -20,9 +21,64 @@ def IDd(f):
         return f(client, *args, **kwds)
     return wrapper
 
+def resolve(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+def page_result(msg: message.Message):
+    names = msg.str_payload()
+    return (names.split('\n') if names else []), msg.str_header()
+
+class Subscription(object):
+
+    def __init__(self, client, filter=None, maxsize=const.QUEUE_SIZE):
+        self.client = client
+        self.maxsize = maxsize
+        if filter is None:
+            filter = Client.UNSOLICITED
+        if isinstance(filter, str):
+            filter = (filter,)
+        if not callable(filter):
+            handlers = frozenset(filter)
+            filter = lambda msg: msg.handler in handlers
+        self.filter = filter
+        self.closed = False
+        self._queue = collections.deque()
+        self._waiter = None
+
+    def full(self):
+        return len(self._queue) >= self.maxsize
+
+    def put(self, msg: message.Message):
+        self._queue.append(msg)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.client.unsubscribe(self)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.Future(loop=self.client.loop)
+            await self._waiter
+        msg = self._queue.popleft()
+        self.client.subscription_drained()
+        return msg
+
 class Client(BaseProtocol):
 
     NO_ID_NAME = 'Unidentified'
+    UNSOLICITED = ('broadcast', 'client_msg')
 
     def __init__(self, loop, handlers = {}):
         super().__init__()
@@ -30,9 +86,74 @@ class Client(BaseProtocol):
         self.identified = False
         self.loop = loop
         self.disconnected = asyncio.Future(loop=self.loop)
+        self._subscriptions = []
+        self._reading_paused = False
+        # Requests awaiting replies, reading is not paused while there are
+        # any so that their replies are read past full subscriptions
+        self._waiting = 0
+        # Listing results by query and their expiry, None until
+        # enable_cache. Emptied whenever the server pushes a new generation
+        # or this client changes rooms, which bumps the epoch
+        self.generation = 0
+        self._cache = None
+        self._cache_ttl = 0.0
+        self._epoch = 0
+        # Tasks of queries sent and not yet answered and how many callers
+        # await each, shared by identical queries made meanwhile
+        self._inflight = {}
+        # Futures of listing requests awaiting replies by request handler.
+        # Replies to each kind of request come in the order they were sent
+        self._pending = {}
+        # Called when the server refuses a request, by request handler
+        self._refused = {}
 
     def connection_lost(self, exc):
+        super().connection_lost(exc)
         self.disconnected.set_result(True)
+        for subscription in list(self._subscriptions):
+            subscription.close()
+
+    def messages(self, filter=None, maxsize=const.QUEUE_SIZE):
+        # filter is a handler name, a collection of them or a predicate
+        subscription = Subscription(self, filter=filter, maxsize=maxsize)
+        if self.disconnected.done():
+            subscription.closed = True
+        else:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+        self.subscription_drained()
+
+    def subscription_drained(self):
+        if self._reading_paused:
+            self.update_reading()
+
+    def update_reading(self):
+        # Stop reading from the socket until consumers catch up, unless
+        # replies to requests are still to be read
+        pause = not self._waiting and any(subscription.full() for
+                subscription in self._subscriptions)
+        if pause == self._reading_paused or self.transport.is_closing():
+            return
+        self._reading_paused = pause
+        if pause:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+
+    def publish(self, msg: message.Message) -> bool:
+        published = False
+        for subscription in self._subscriptions:
+            if not subscription.filter(msg):
+                continue
+            subscription.put(msg)
+            published = True
+            if subscription.full() and not self._reading_paused:
+                self.update_reading()
+        return published
 
     def connected(self):
         return not self.disconnected.done()
@@ -47,15 +168,20 @@ class Client(BaseProtocol):
             handler = built_ins.get(msg.handler, False)
             if not handler is False:
                 handler(msg)
-            self.transport.write(bytes(msg))
+            self.write_message(msg)
 
     def send_identify(self, msg):
         self.name = msg.str_payload()
 
+    def send_id_prove(self, msg):
+        if msg.header_length:
+            self.name = msg.str_header()
+
     def add_handler(self, name, handler):
         setattr(self, name, types.MethodType(handler, self))
 
     def handle(self, msg: message.Message):
+        published = self._subscriptions and self.publish(msg)
         built_ins = {
             name.replace('handle_', ''): method \
                     for name, method in inspect.getmembers(self,
@@ -63,6 +189,8 @@ class Client(BaseProtocol):
                     if name.startswith('handle_')}
         handler = built_ins.get(msg.handler, False)
         if handler is False:
+            if published:
+                return
             print('WARN: %s %s handler not found: %s' % (
                 self.__class__.__qualname__, self.name, msg.handler))
             return
@@ -70,9 +198,13 @@ class Client(BaseProtocol):
 
     @classmethod
     def create_connection(cls, addr=const.ADDR, port=const.PORT,
-            loop=asyncio.get_event_loop(), in_loop=False):
+            loop=asyncio.get_event_loop(), in_loop=False, unix=None):
         self = cls(loop)
-        coro = loop.create_connection(lambda: self, addr, port)
+        if unix is None:
+            coro = loop.create_connection(lambda: self, addr, port)
+        else:
+            coro = loop.create_unix_connection(lambda: self,
+                    unix_address(unix))
         if in_loop is False:
             self.sock, proto = loop.run_until_complete(coro)
         else:
@@ -85,14 +217,26 @@ class Client(BaseProtocol):
             loop.create_task(coro).add_done_callback(connection_created)
         return self
 
+    @classmethod
+    def create_loopback(cls, server, loop=asyncio.get_event_loop()):
+        self = cls(loop)
+        self.sock, handler = loopback.connect(self, server, loop)
+        return self
+
     async def disconnect(self):
         if not self.disconnected.done():
             self.send(message.Terminate)
             await self.disconnected
 
     async def wait(self, *args):
-        res = await asyncio.wait([self.disconnected] + list(args),
-                loop=self.loop, return_when=asyncio.FIRST_COMPLETED)
+        self._waiting += 1
+        self.update_reading()
+        try:
+            res = await asyncio.wait([self.disconnected] + list(args),
+                    loop=self.loop, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._waiting -= 1
+            self.update_reading()
         if self.disconnected.done():
             raise ConnectionResetError
         return res
@@ -105,36 +249,157 @@ class Client(BaseProtocol):
         await self.wait(future)
         return future.result()
 
-    async def identify(self, name):
+    async def identify(self, name, password=None):
         future = asyncio.Future(loop=self.loop)
+        failed = asyncio.Future(loop=self.loop)
         self.add_handler('handle_identified', lambda client, msg:
-            future.set_result(True))
-        self.send(message.Identify(name))
+            resolve(future, True))
+        self.add_handler('handle_id_protected', lambda client, msg:
+            resolve(failed, 'password required for ' + name))
+        self.add_handler('handle_id_rejected', lambda client, msg:
+            resolve(failed, 'wrong password for ' + name))
+        # Refused while deriving the key, or the connection was refused
+        self._refused['id_prove'] = self._refused[''] = lambda: \
+                resolve(failed, 'server busy')
+        if password is None:
+            self.send(message.Identify(name))
+        else:
+            self.send(message.IDProve(password, name))
         self.identified = True
-        await self.wait(future)
+        await self.wait(future, failed)
+        if not future.done():
+            future.cancel()
+        if failed.done():
+            self.identified = False
+            return failed.result()
+        failed.cancel()
 
     @IDd
     async def create_room(self, room):
         future = asyncio.Future(loop=self.loop)
         self.add_handler('handle_room_created', lambda client, msg:
             future.set_result(True))
+        self.invalidate()
         self.send(message.CreateRoom(room))
         await self.wait(future)
 
     @IDd
-    async def list_rooms(self):
+    async def enable_cache(self, ttl=const.CACHE_TTL):
+        # Asks the server to push its generation on every room change
         future = asyncio.Future(loop=self.loop)
-        self.add_handler('handle_room_list', lambda client, msg:
-            future.set_result(msg.str_payload()))
-        self.send(message.ListRooms)
+        self.add_handler('handle_generation', lambda client, msg:
+            resolve(future, client.set_generation(msg)))
+        self.send(message.Watch)
+        await self.wait(future)
+        del self.handle_generation
+        self._cache = {}
+        self._cache_ttl = ttl
+
+    def set_generation(self, msg: message.Message):
+        generation = int(msg.str_payload())
+        if generation != self.generation:
+            self.generation = generation
+            self.invalidate()
+
+    def handle_generation(self, msg):
+        self.set_generation(msg)
+
+    def handle_room_list(self, msg):
+        self.answer('list_rooms', msg)
+
+    def handle_member_list(self, msg):
+        self.answer('room_members', msg)
+
+    def handle_server_busy(self, msg):
+        request = msg.str_header()
+        if self._pending.get(request):
+            return self.answer(request, None)
+        refused = self._refused.get(request)
+        if refused is not None:
+            refused()
+
+    def answer(self, request, msg):
+        # Resolves the oldest request of its kind, None when refused
+        pending = self._pending.get(request)
+        if not pending:
+            return
+        future, result = pending.popleft()
+        resolve(future, None if msg is None else result(msg))
+
+    def invalidate(self):
+        self._epoch += 1
+        if self._cache:
+            self._cache.clear()
+
+    async def query(self, msg, result):
+        key = (msg.handler, msg.header, msg.payload)
+        if self._cache is not None:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > self.loop.time():
+                return entry[1]
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = self.loop.create_task(self.request(key, msg, result))
+            inflight = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda task: self.forget(key, task))
+        task = inflight[0]
+        inflight[1] += 1
+        try:
+            # One caller giving up does not cancel the query for the others
+            return await asyncio.shield(task, loop=self.loop)
+        finally:
+            inflight[1] -= 1
+            if not inflight[1] and not task.done():
+                task.cancel()
+                self.forget(key, task)
+
+    def forget(self, key, task):
+        if self._inflight.get(key, (None,))[0] is task:
+            del self._inflight[key]
+
+    async def request(self, key, msg, result):
+        epoch = self._epoch
+        future = asyncio.Future(loop=self.loop)
+        # Left in place when the request is cancelled so the reply to it
+        # is still matched to it
+        self._pending.setdefault(msg.handler, collections.deque()).append(
+                (future, result))
+        self.send(msg)
         await self.wait(future)
+        # Results from before a change made meanwhile may be stale
+        if self._cache is not None and future.result() is not None and \
+                epoch == self._epoch:
+            self._cache[key] = (self.loop.time() + self._cache_ttl,
+                    future.result())
         return future.result()
 
+    @IDd
+    async def list_rooms(self):
+        return await self.query(message.ListRooms,
+                message.Message.str_payload)
+
+    @IDd
+    async def list_rooms_page(self, limit=const.PAGE_SIZE, cursor='',
+            prefix=''):
+        return await self.query(message.ListRoomsPage(limit, cursor, prefix),
+                page_result)
+
+    async def iter_rooms(self, prefix='', page_size=const.PAGE_SIZE):
+        cursor = None
+        while cursor != '':
+            page = await self.list_rooms_page(page_size, cursor or '', prefix)
+            if page is None:
+                return
+            rooms, cursor = page
+            for room in rooms:
+                yield room
+
     @IDd
     async def join_room(self, room):
         future = asyncio.Future(loop=self.loop)
         self.add_handler('handle_room_joined', lambda client, msg:
             future.set_result(True))
+        self.invalidate()
         self.send(message.JoinRoom(room))
         await self.wait(future)
 
@@ -143,17 +408,32 @@ class Client(BaseProtocol):
         future = asyncio.Future(loop=self.loop)
         self.add_handler('handle_room_left', lambda client, msg:
             future.set_result(True))
+        self.invalidate()
         self.send(message.LeaveRoom(room))
         await self.wait(future)
 
     @IDd
     async def room_members(self, room):
-        future = asyncio.Future(loop=self.loop)
-        self.add_handler('handle_member_list', lambda client, msg:
-            future.set_result(msg.str_payload()))
-        self.send(message.RoomMembers(room))
-        await self.wait(future)
-        return future.result()
+        return await self.query(message.RoomMembers(room),
+                message.Message.str_payload)
+
+    @IDd
+    async def room_members_page(self, room, limit=const.PAGE_SIZE, cursor='',
+            prefix=''):
+        return await self.query(message.RoomMembersPage(room, limit, cursor,
+            prefix), page_result)
+
+    async def iter_room_members(self, room, prefix='',
+            page_size=const.PAGE_SIZE):
+        cursor = None
+        while cursor != '':
+            page = await self.room_members_page(room, page_size, cursor or '',
+                    prefix)
+            if page is None:
+                return
+            members, cursor = page
+            for member in members:
+                yield member
 
     @IDd
     async def msg_room(self, room, payload):
@@ -163,6 +443,7 @@ class Client(BaseProtocol):
             future.set_result(True))
         self.add_handler('handle_no_room', lambda client, msg:
             none.set_result('no such room ' + room))
+        self._refused['msg_room'] = lambda: resolve(none, 'server busy')
         self.send(message.MsgRoom(room, payload))
         res = await self.wait(future, none)
         if not future.done():
@@ -173,14 +454,17 @@ class Client(BaseProtocol):
             return none.result()
 
     @IDd
-    async def msg_client(self, client_name, payload):
+    async def msg_client(self, client_name, payload, *, ttl=None):
         future = asyncio.Future(loop=self.loop)
         none = asyncio.Future(loop=self.loop)
         self.add_handler('handle_client_msgd', lambda client, msg:
             future.set_result(True))
+        # Held by the server until the client connects
+        self.add_handler('handle_client_msg_queued', lambda client, msg:
+            future.set_result(True))
         self.add_handler('handle_no_client', lambda client, msg:
             none.set_result('no such client ' + client_name))
-        self.send(message.MsgClient(client_name, payload))
+        self.send(message.MsgClient(client_name, payload, ttl=ttl))
         res = await self.wait(future, none)
         if not future.done():
             future.cancel()
@@ -189,6 +473,21 @@ class Client(BaseProtocol):
         else:
             return none.result()
 
+    @IDd
+    async def profile(self, seconds=None):
+        # Path the server writes the profile to, or why it refused
+        future = asyncio.Future(loop=self.loop)
+        self.add_handler('handle_profiling', lambda client, msg:
+            resolve(future, msg.str_payload()))
+        self.add_handler('handle_not_admin', lambda client, msg:
+            resolve(future, 'not an admin'))
+        self.add_handler('handle_bad_request', lambda client, msg:
+            resolve(future, 'invalid seconds'))
+        self._refused['profile'] = lambda: resolve(future, 'server busy')
+        self.send(message.Profile(seconds))
+        await self.wait(future)
+        return future.result()
+
 class CLIClient(Client):
 
     def handle_broadcast(self, msg):
@@ -206,9 +505,10 @@ class CLIClient(Client):
 
 class ClientCLI(asyncio.Protocol):
 
-    def __init__(self, loop=asyncio.get_event_loop()):
+    def __init__(self, loop=asyncio.get_event_loop(), unix=None):
         super().__init__()
         self.loop = loop
+        self.unix = unix
         self.clients = {}
         self.rooms = {}
         self.active = None
@@ -247,7 +547,7 @@ class ClientCLI(asyncio.Protocol):
             print('An error has occurred:', err)
 
     def handle_connect(self, server_id, *args, addr=const.ADDR,
-            port=const.PORT):
+            port=const.PORT, unix=None):
         def connected(err):
             if not err is None:
                 return print('Error connecting to', server_id, err)
@@ -256,7 +556,8 @@ class ClientCLI(asyncio.Protocol):
             self.clients[server_id] = client
             print('Connected to', server_id)
         client = CLIClient.create_connection(addr=addr, port=port,
-                loop=self.loop, in_loop=connected)
+                loop=self.loop, in_loop=connected,
+                unix=self.unix if unix is None else unix)
 
     def helper_connect(self):
         print('/connect server_id address port')
@@ -330,13 +631,18 @@ def cli():
             help='Address to bind to')
     parser.add_argument('--port', type=int, default=const.PORT,
             help='Port to bind to')
+    parser.add_argument('--unix', type=str, default=None, metavar='PATH',
+            help='Connect over unix socket PATH, prefix with @ for the '
+            'abstract namespace')
     args = parser.parse_args()
 
     loop = asyncio.get_event_loop()
     if args.server:
-        server = Server.start(addr=args.addr, port=args.port, loop=loop)
+        server = Server.start(addr=args.addr, port=args.port, loop=loop,
+                unix=() if args.unix is None else args.unix)
         print('Server hosted on port {}'.format(server.port))
-    coro = loop.connect_read_pipe(lambda: ClientCLI(loop=loop), sys.stdin)
+    coro = loop.connect_read_pipe(lambda: ClientCLI(loop=loop,
+        unix=args.unix), sys.stdin)
     loop.run_until_complete(coro)
     try:
         loop.run_forever()
@@ -344,8 +650,8 @@ def cli():
         pass
 
     if args.server:
-        server._sock.close()
-        loop.run_until_complete(server._sock.wait_closed())
+        server.close()
+        loop.run_until_complete(server.wait_closed())
     loop.close()
 
 if __name__ == '__main__':
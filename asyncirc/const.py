@@ -1,2 +1,33 @@
 ADDR = '127.0.0.1'
 PORT = 13180
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+QUEUE_SIZE = 256
+HANDOFF_TIMEOUT = 10.0
+DRAIN_TIMEOUT = 30.0
+MAX_PENDING = 64
+KDF_ITERATIONS = 200000
+MAX_KDF_PENDING = 256
+CREDENTIAL_TTL = 60.0
+CREDENTIAL_CACHE_SIZE = 10000
+WRITE_HIGH_WATER = 16 * 1024
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+OFFLINE_TTL = 24 * 60 * 60.0
+OFFLINE_MAX_MESSAGES = 100
+OFFLINE_MAX_BYTES = 64 * 1024 * 1024
+LAG_INTERVAL = 0.25
+SLOW_CALLBACK = 0.1
+PROFILE_SECONDS = 10.0
+MAX_PROFILE_SECONDS = 300.0
+CAPTURE_FLUSH_INTERVAL = 0.5
+CAPTURE_BATCH = 1024
+CAPTURE_MAX_PENDING = 256 * 1024
+MAX_CONNECTIONS = 10000
+MAX_UNIDENTIFIED = 1000
+IDENTIFY_DEADLINE = 30.0
+SHED_LAG = 0.5
+SHED_BUFFERED = 64 * 1024 * 1024
+BUFFERED_INTERVAL = 0.25
+CACHE_TTL = 30.0
+OFFLINE_MAX_RECIPIENTS = 100000
+OFFLINE_MAX_SPILL_BYTES = 1024 * 1024 * 1024
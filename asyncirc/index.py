@@ -0,0 +1,42 @@
+import bisect
+from typing import List, Tuple
+
+class SortedIndex(object):
+
+    def __init__(self):
+        self._names: List[str] = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name: str):
+        i = bisect.bisect_left(self._names, name)
+        return i < len(self._names) and self._names[i] == name
+
+    def add(self, name: str):
+        i = bisect.bisect_left(self._names, name)
+        if i < len(self._names) and self._names[i] == name:
+            return
+        self._names.insert(i, name)
+
+    def discard(self, name: str):
+        i = bisect.bisect_left(self._names, name)
+        if i < len(self._names) and self._names[i] == name:
+            del self._names[i]
+
+    def page(self, limit: int, cursor: str = '',
+            prefix: str = '') -> Tuple[List[str], str]:
+        # Names after cursor starting with prefix, and the next page's cursor
+        start = bisect.bisect_left(self._names, prefix)
+        if cursor:
+            start = max(start, bisect.bisect_right(self._names, cursor))
+        page = []
+        for name in self._names[start:start + limit]:
+            if not name.startswith(prefix):
+                return page, ''
+            page.append(name)
+        end = start + len(page)
+        if page and end < len(self._names) and \
+                self._names[end].startswith(prefix):
+            return page, page[-1]
+        return page, ''
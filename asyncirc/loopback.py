@@ -0,0 +1,159 @@
+import asyncio
+import collections
+from typing import Callable, Tuple
+
+from .message import Message
+
+class LoopbackTransport(asyncio.Transport):
+
+    HIGH_WATER = 64 * 1024
+
+    def __init__(self, loop, protocol: asyncio.Protocol):
+        super().__init__({'peername': 'loopback', 'sockname': 'loopback'})
+        self._loop = loop
+        self._protocol = protocol
+        self._peer = None
+        # Data written by the peer which our protocol has not yet received
+        self._inbox = collections.deque()
+        self._inbox_size = 0
+        self._scheduled = False
+        self._reading_paused = False
+        self._writing_paused = False
+        self._eof = False
+        self._closing = False
+        self._closed = False
+        self.set_write_buffer_limits()
+
+    def get_protocol(self):
+        return self._protocol
+
+    def set_protocol(self, protocol: asyncio.Protocol):
+        self._protocol = protocol
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._inbox.clear()
+        self._inbox_size = 0
+        if self._peer is not None:
+            self._peer._feed_eof()
+        self._lose()
+
+    def abort(self):
+        self.close()
+
+    def is_reading(self):
+        return not self._reading_paused and not self._closing
+
+    def pause_reading(self):
+        self._reading_paused = True
+
+    def resume_reading(self):
+        if not self._reading_paused:
+            return
+        self._reading_paused = False
+        self._schedule()
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        if high is None:
+            high = self.HIGH_WATER if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError('high (%r) must be >= low (%r) must be >= 0' % (
+                high, low))
+        self._high_water = high
+        self._low_water = low
+
+    def get_write_buffer_limits(self):
+        return self._low_water, self._high_water
+
+    def get_write_buffer_size(self):
+        if self._peer is None:
+            return 0
+        return self._peer._inbox_size
+
+    def can_write_eof(self):
+        return False
+
+    def write(self, data):
+        if not data:
+            return
+        self._send(bytes(data))
+
+    def writelines(self, list_of_data):
+        self.write(b''.join(list_of_data))
+
+    def write_message(self, msg: Message):
+        self._send(msg)
+
+    def _send(self, item):
+        if self._closing or self._peer is None or self._peer._closing:
+            return
+        self._peer._receive(item)
+        if not self._writing_paused and \
+                self.get_write_buffer_size() > self._high_water:
+            self._writing_paused = True
+            self._protocol.pause_writing()
+
+    def _receive(self, item):
+        self._inbox.append(item)
+        self._inbox_size += len(item)
+        self._schedule()
+
+    def _feed_eof(self):
+        self._eof = True
+        self._schedule()
+
+    def _schedule(self):
+        if self._scheduled or self._closed:
+            return
+        self._scheduled = True
+        self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._scheduled = False
+        protocol = self._protocol
+        while self._inbox and not self._reading_paused and not self._closing:
+            item = self._inbox.popleft()
+            self._inbox_size -= len(item)
+            if isinstance(item, bytes):
+                protocol.data_received(item)
+            elif hasattr(protocol, 'message_received'):
+                protocol.message_received(item)
+            else:
+                protocol.data_received(bytes(item))
+        if self._peer is not None:
+            self._peer._maybe_resume_writing()
+        if self._eof and not self._inbox:
+            self._lose()
+
+    def _maybe_resume_writing(self):
+        if self._writing_paused and not self._closed and \
+                self.get_write_buffer_size() <= self._low_water:
+            self._writing_paused = False
+            self._protocol.resume_writing()
+
+    def _lose(self):
+        if self._closed:
+            return
+        self._closing = True
+        self._closed = True
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+def connect(protocol: asyncio.Protocol,
+        protocol_factory: Callable[[], asyncio.Protocol],
+        loop) -> Tuple[LoopbackTransport, asyncio.Protocol]:
+    # protocol_factory is usually a Server, peer is then its ClientHandler
+    peer = protocol_factory()
+    transport = LoopbackTransport(loop, protocol)
+    peer_transport = LoopbackTransport(loop, peer)
+    transport._peer = peer_transport
+    peer_transport._peer = transport
+    peer.connection_made(peer_transport)
+    protocol.connection_made(transport)
+    return transport, peer
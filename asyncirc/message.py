@@ -1,8 +1,13 @@
-import collections
+import sys
 import struct
 
+from . import const
+
 class Message(object):
 
+    __slots__ = ('handler', 'header', 'payload', 'handler_length',
+            'header_length', 'payload_length')
+
     # Network Byte Order (big-endian)
     # Handler - String of length 50
     ENCODING = 'utf-8'
@@ -10,9 +15,7 @@ class Message(object):
     BODY_FORMAT = '{}s{}s{}s'
     INITIAL_FIELDS = 'handler_length header_length payload_length'
     BODY_FIELDS = 'handler header payload'
-    INITIAL = collections.namedtuple('Initial', INITIAL_FIELDS)
-    MESSAGE = collections.namedtuple('Message', INITIAL_FIELDS + ' ' + \
-            BODY_FIELDS)
+    INITIAL = struct.Struct(INITIAL_FORMAT)
 
     def __init__(self, handler: str, header: bytes, payload: bytes):
         self.handler = handler
@@ -23,11 +26,13 @@ class Message(object):
         self.payload_length = len(payload)
 
     def __bytes__(self) -> bytes:
-        return struct.pack(self.INITIAL_FORMAT + \
-                self.BODY_FORMAT.format(self.handler_length, self.header_length,
-                    self.payload_length),
-                self.handler_length, self.header_length, self.payload_length,
-                self.handler.encode(self.ENCODING), self.header, self.payload)
+        return b''.join((self.INITIAL.pack(self.handler_length,
+            self.header_length, self.payload_length),
+            self.handler.encode(self.ENCODING), self.header, self.payload))
+
+    def __len__(self) -> int:
+        return self.INITIAL.size + self.handler_length + \
+                self.header_length + self.payload_length
 
     def str_payload(self) -> str:
         return self.payload.decode(self.ENCODING, errors='ignore')
@@ -35,24 +40,58 @@ class Message(object):
     def str_header(self) -> str:
         return self.header.decode(self.ENCODING, errors='ignore')
 
+    @classmethod
+    def complete(cls, data: bytes,
+            max_size: int = const.MAX_FRAME_SIZE) -> int:
+        # Length of the longest prefix of data holding only whole messages,
+        # raises ValueError on a message longer than max_size
+        initial = cls.INITIAL
+        offset = 0
+        while offset + initial.size <= len(data):
+            size = initial.size + sum(initial.unpack_from(data, offset))
+            if size > max_size:
+                raise ValueError('message of %d bytes is over %d' % (
+                    size, max_size))
+            end = offset + size
+            if end > len(data):
+                break
+            offset = end
+        return offset
+
     @classmethod
     def decode(cls, msg: bytes):
-        while len(msg):
-            initialSize = struct.calcsize(cls.INITIAL_FORMAT)
-            initial = cls.INITIAL._make(struct.unpack(cls.INITIAL_FORMAT,
-                msg[:initialSize]))
-            structFormat = cls.INITIAL_FORMAT + \
-                    cls.BODY_FORMAT.format(initial.handler_length,
-                            initial.header_length, initial.payload_length)
-            msgSize = struct.calcsize(structFormat)
-            message = cls.MESSAGE._make(struct.unpack(structFormat,
-                msg[:msgSize]))
-            yield cls(message.handler.decode(cls.ENCODING, errors='ignore'),
-                    message.header, message.payload)
-            msg = msg[msgSize:]
+        initial = cls.INITIAL
+        offset = 0
+        while offset < len(msg):
+            handler_length, header_length, payload_length = \
+                    initial.unpack_from(msg, offset)
+            handler_start = offset + initial.size
+            header_start = handler_start + handler_length
+            payload_start = header_start + header_length
+            offset = payload_start + payload_length
+            if offset > len(msg):
+                raise struct.error('message truncated at %d of %d bytes' % (
+                    len(msg), offset))
+            # Handler names repeat in every message, share one str for each
+            yield cls(sys.intern(msg[handler_start:header_start]\
+                    .decode(cls.ENCODING, errors='ignore')),
+                    msg[header_start:payload_start],
+                    msg[payload_start:offset])
+
+def page_query(limit: int, cursor: str = '', prefix: str = '') -> bytes:
+    return '\n'.join([str(limit), cursor, prefix]).encode(Message.ENCODING)
+
+def parse_page_query(msg: Message):
+    # Empty header means the whole listing was requested
+    if not msg.header_length:
+        return None
+    limit, cursor, prefix = msg.str_header().split('\n', 2)
+    return int(limit), cursor, prefix
 
 class Echo(Message):
 
+    __slots__ = ()
+
     def __init__(self, text):
         super().__init__('echo', b'', text.encode(self.ENCODING))
 
@@ -64,11 +103,15 @@ ReqID = Message('req_id', b'', b'')
 
 class Identify(Message):
 
+    __slots__ = ()
+
     def __init__(self, client_name):
         super().__init__('identify', b'', client_name.encode(self.ENCODING))
 
 Identified = Message('identified', b'', b'')
 IDTaken = Message('id_taken', b'', b'')
+IDProtected = Message('id_protected', b'', b'')
+IDRejected = Message('id_rejected', b'', b'')
 ListRooms = Message('list_rooms', b'', b'')
 RoomCreated = Message('room_created', b'', b'')
 RoomLeft = Message('room_left', b'', b'')
@@ -76,52 +119,121 @@ RoomJoined = Message('room_joined', b'', b'')
 RoomMsgd = Message('room_msgd', b'', b'')
 NoRoom = Message('no_room', b'', b'')
 ClientMsgd = Message('client_msgd', b'', b'')
+ClientMsgQueued = Message('client_msg_queued', b'', b'')
+NotAdmin = Message('not_admin', b'', b'')
+BadRequest = Message('bad_request', b'', b'')
+Watch = Message('watch', b'', b'')
 
 class LeaveRoom(Message):
 
+    __slots__ = ()
+
     def __init__(self, room):
         super().__init__('leave_room', b'', room.encode(self.ENCODING))
 
+class ListRoomsPage(Message):
+
+    __slots__ = ()
+
+    def __init__(self, limit, cursor='', prefix=''):
+        super().__init__('list_rooms', page_query(limit, cursor, prefix), b'')
+
 class RoomList(Message):
 
-    def __init__(self, rooms):
-        super().__init__('room_list', b'',
+    __slots__ = ()
+
+    def __init__(self, rooms, cursor=''):
+        super().__init__('room_list', cursor.encode(self.ENCODING),
                 '\n'.join(rooms).encode(self.ENCODING))
 
+class ServerBusy(Message):
+
+    __slots__ = ()
+
+    def __init__(self, request=''):
+        # Names the refused request, empty when refusing the connection
+        super().__init__('server_busy', request.encode(self.ENCODING), b'')
+
 class IDProve(Message):
 
-    def __init__(self, password):
-        super().__init__('id_prove', b'', password.encode(self.ENCODING))
+    __slots__ = ()
+
+    def __init__(self, password, client_name=''):
+        super().__init__('id_prove', client_name.encode(self.ENCODING),
+                password.encode(self.ENCODING))
+
+class Profile(Message):
+
+    __slots__ = ()
+
+    def __init__(self, seconds=None):
+        super().__init__('profile', b'', b'' if seconds is None else \
+                str(seconds).encode(self.ENCODING))
+
+class Profiling(Message):
+
+    __slots__ = ()
+
+    def __init__(self, path):
+        super().__init__('profiling', b'', path.encode(self.ENCODING))
+
+class Generation(Message):
+
+    __slots__ = ()
+
+    def __init__(self, generation):
+        super().__init__('generation', b'', str(generation).encode(
+            self.ENCODING))
 
 class CreateRoom(Message):
 
+    __slots__ = ()
+
     def __init__(self, room_name):
         super().__init__('create_room', b'', room_name.encode(self.ENCODING))
 
 class JoinRoom(Message):
 
+    __slots__ = ()
+
     def __init__(self, room_name):
         super().__init__('join_room', b'', room_name.encode(self.ENCODING))
 
 class RoomMembers(Message):
 
+    __slots__ = ()
+
     def __init__(self, room_name):
         super().__init__('room_members', b'', room_name.encode(self.ENCODING))
 
+class RoomMembersPage(Message):
+
+    __slots__ = ()
+
+    def __init__(self, room_name, limit, cursor='', prefix=''):
+        super().__init__('room_members', page_query(limit, cursor, prefix),
+                room_name.encode(self.ENCODING))
+
 class MemberList(Message):
 
-    def __init__(self, member_list):
-        super().__init__('member_list', b'',
+    __slots__ = ()
+
+    def __init__(self, member_list, cursor=''):
+        super().__init__('member_list', cursor.encode(self.ENCODING),
                 '\n'.join(member_list).encode(self.ENCODING))
 
 class MsgRoom(Message):
 
+    __slots__ = ()
+
     def __init__(self, room_name, payload):
         super().__init__('msg_room', room_name.encode(self.ENCODING),
                 payload.encode(self.ENCODING))
 
 class Broadcast(Message):
 
+    __slots__ = ()
+
     def __init__(self, room_name, client_name, payload):
         super().__init__('broadcast', ':'.join([room_name, client_name])\
                 .encode(self.ENCODING), payload)
@@ -136,17 +248,34 @@ class Broadcast(Message):
 
 class MsgClient(Message):
 
-    def __init__(self, client_name, payload, unencoded=False):
-        super().__init__('msg_client', client_name.encode(self.ENCODING),
+    __slots__ = ()
+
+    def __init__(self, client_name, payload, unencoded=False, ttl=None):
+        # ttl is how long the server may hold the message for an offline
+        # client, 0 to never hold it
+        header = client_name if ttl is None else \
+                '%s\n%s' % (client_name, ttl)
+        super().__init__('msg_client', header.encode(self.ENCODING),
                 payload if unencoded else payload.encode(self.ENCODING))
 
+    def client_name(self):
+        return self.str_header().split('\n')[0]
+
+    def ttl(self):
+        return float(self.str_header().split('\n')[1]) \
+                if '\n' in self.str_header() else None
+
 class ClientMsg(Message):
 
+    __slots__ = ()
+
     def __init__(self, client_name, payload, unencoded=False):
         super().__init__('client_msg', client_name.encode(self.ENCODING),
                 payload if unencoded else payload.encode(self.ENCODING))
 
 class NoClient(Message):
 
+    __slots__ = ()
+
     def __init__(self, client_name):
         super().__init__('no_client', b'', client_name.encode(self.ENCODING))
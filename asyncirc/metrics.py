@@ -0,0 +1,68 @@
+import collections
+from typing import Dict
+
+class Timing(object):
+
+    __slots__ = ('count', 'total', 'max', '_samples')
+
+    SAMPLES = 1024
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # Most recent samples, percentiles are computed over these
+        self._samples = collections.deque(maxlen=self.SAMPLES)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> float:
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1,
+            int(len(samples) * percent / 100.0))]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            }
+
+class Metrics(object):
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, Timing] = {}
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def adjust(self, name: str, value: float):
+        self.gauges[name] = self.gauges.get(name, 0) + value
+
+    def timing(self, name: str, seconds: float):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = Timing()
+        timing.add(seconds)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'timings': {name: timing.summary() for name, timing in
+                self.timings.items()},
+            }
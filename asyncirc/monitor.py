@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+import cProfile
+import tempfile
+from typing import Optional
+
+from .metrics import Metrics
+from . import const
+
+class LagMonitor(object):
+
+    def __init__(self, metrics: Metrics, interval: float = const.LAG_INTERVAL,
+            loop=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.loop = loop
+        # Seconds the last tick ran behind when it was due
+        self.lag = 0.0
+        self._due = 0.0
+        self._timer = None
+
+    def start(self):
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.schedule()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def schedule(self):
+        self._due = self.loop.time() + self.interval
+        self._timer = self.loop.call_at(self._due, self.tick)
+
+    def tick(self):
+        self.lag = max(0.0, self.loop.time() - self._due)
+        self.metrics.timing('loop.lag', self.lag)
+        self.metrics.gauge('loop.lag', self.lag)
+        self.schedule()
+
+class Profiler(object):
+
+    def __init__(self, directory: Optional[str] = None, loop=None):
+        self.directory = tempfile.gettempdir() if directory is None \
+                else directory
+        self.loop = loop
+        # Path the running profile is written to, None when not profiling
+        self.path = None
+        self._profile = None
+        self._timer = None
+
+    def start(self, seconds: float = const.PROFILE_SECONDS) -> Optional[str]:
+        # Returns None when a profile is already being recorded
+        if self._profile is not None:
+            return None
+        loop = self.loop or asyncio.get_event_loop()
+        seconds = max(0.0, min(seconds, const.MAX_PROFILE_SECONDS))
+        self.path = os.path.join(self.directory, 'asyncirc-%d-%d.prof' % (
+            os.getpid(), int(time.time() * 1000)))
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._timer = loop.call_later(seconds, self.stop)
+        return self.path
+
+    def stop(self) -> Optional[asyncio.Future]:
+        # Stats are written by an executor, returns the future doing so
+        if self._profile is None:
+            return None
+        profile, path = self._profile, self.path
+        profile.disable()
+        self._timer.cancel()
+        self._profile = self._timer = self.path = None
+        loop = self.loop or asyncio.get_event_loop()
+        return loop.run_in_executor(None, profile.dump_stats, path)
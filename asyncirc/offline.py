@@ -0,0 +1,296 @@
+import os
+import math
+import time
+import heapq
+import struct
+import asyncio
+import itertools
+import collections
+import concurrent.futures
+from typing import Dict, List, Optional, Tuple
+
+from .message import Message, ClientMsg
+from . import const
+
+# Approximate bytes of bookkeeping for each held message and each recipient
+# with held messages, counted against max_bytes along with the payloads
+ENTRY_OVERHEAD = 256
+RECIPIENT_OVERHEAD = 512
+# Sequence number of the heap entry for a recipient's spill file
+SPILL = -1
+
+class Spill(object):
+
+    __slots__ = ('count', 'size', 'expires')
+
+    def __init__(self):
+        # Messages and payload bytes in the file, and when the last expires
+        self.count = 0
+        self.size = 0
+        self.expires = 0.0
+
+class OfflineStore(object):
+
+    def __init__(self, ttl: float = const.OFFLINE_TTL,
+            max_messages: int = const.OFFLINE_MAX_MESSAGES,
+            max_bytes: int = const.OFFLINE_MAX_BYTES,
+            max_recipients: int = const.OFFLINE_MAX_RECIPIENTS,
+            spill: Optional[str] = None,
+            max_spill_bytes: int = const.OFFLINE_MAX_SPILL_BYTES, loop=None):
+        # Messages over max_bytes in memory go to files in the spill
+        # directory, or are dropped when there is none
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_recipients = max_recipients
+        self.spill = spill
+        self.max_spill_bytes = max_spill_bytes
+        self.loop = loop
+        self.size = 0
+        self.spill_size = 0
+        self.count = 0
+        self.dropped = 0
+        self.expired = 0
+        # Recipient to its messages by sequence number, in the order sent
+        self._queues: Dict[str, collections.OrderedDict] = {}
+        # Recipients with messages on disk. Once a recipient has any all its
+        # later messages are spilled too, so those on disk are the newest
+        self._spilled: Dict[str, Spill] = {}
+        # One heap of (expires, seq, recipient) for every message held in
+        # memory and every spill file, with a single timer for the earliest
+        self._heap = []
+        self._timer = None
+        self._seq = itertools.count()
+        # Spill files are only touched by this one thread, in order
+        self._files = None
+        # Files left by an earlier run are held until they expire
+        if spill is not None:
+            self.index()
+
+    def __len__(self):
+        return self.count
+
+    def recipients(self) -> int:
+        # Those with messages both in memory and on disk count twice
+        return len(self._queues) + len(self._spilled)
+
+    def put(self, recipient: str, sender: str, payload: bytes,
+            ttl: Optional[float] = None,
+            expires: Optional[float] = None) -> bool:
+        # ttl is clamped to the store's, messages which should not or can
+        # not be held are refused. Messages held again keep their expires
+        if ttl is not None and (not math.isfinite(ttl) or ttl <= 0):
+            return False
+        if expires is not None and expires <= time.time():
+            return False
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        queue = self._queues.get(recipient)
+        spilled = self._spilled.get(recipient)
+        if queue is None and spilled is None and \
+                self.recipients() >= self.max_recipients:
+            self.dropped += 1
+            return False
+        held = (0 if queue is None else len(queue)) + \
+                (0 if spilled is None else spilled.count)
+        if held >= self.max_messages:
+            if not queue:
+                # Rewriting the spill file to drop its oldest is not worth it
+                self.dropped += 1
+                return False
+            self.drop_oldest(recipient, queue)
+        if expires is None:
+            expires = time.time() + ttl
+        seq = next(self._seq)
+        cost = len(payload) + ENTRY_OVERHEAD + \
+                (RECIPIENT_OVERHEAD if not recipient in self._queues else 0)
+        if spilled is not None or self.size + cost > self.max_bytes:
+            return self.spill_message(recipient, seq, expires, sender,
+                    payload)
+        queue = self._queues.setdefault(recipient, collections.OrderedDict())
+        queue[seq] = (expires, sender, payload)
+        self.size += cost
+        self.count += 1
+        self.push(expires, seq, recipient)
+        return True
+
+    def push(self, expires: float, seq: int, recipient: str):
+        heapq.heappush(self._heap, (expires, seq, recipient))
+        if self._heap[0][1] == seq and self._heap[0][2] == recipient:
+            self.schedule()
+
+    def drop_oldest(self, recipient: str, queue: collections.OrderedDict):
+        self.remove(recipient, queue, queue.popitem(last=False)[1])
+        self.dropped += 1
+
+    def remove(self, recipient: str, queue: collections.OrderedDict, entry):
+        self.size -= len(entry[2]) + ENTRY_OVERHEAD
+        self.count -= 1
+        if not queue:
+            del self._queues[recipient]
+            self.size -= RECIPIENT_OVERHEAD
+
+    def take(self, recipient: str) -> List[Message]:
+        # Messages held in memory, those spilled are read by take_spilled
+        queue = self._queues.pop(recipient, None)
+        if queue is None:
+            return []
+        # Their heap entries are skipped when they come up
+        now = time.time()
+        for expires, sender, payload in queue.values():
+            self.size -= len(payload) + ENTRY_OVERHEAD
+        self.size -= RECIPIENT_OVERHEAD
+        self.count -= len(queue)
+        self.compact()
+        return [ClientMsg(sender, payload, unencoded=True) for
+                expires, sender, payload in queue.values() if expires > now]
+
+    def take_spilled(self, recipient: str) -> Optional[asyncio.Future]:
+        # Future of (expires, message) for the spilled messages, newer than
+        # those take returns, or None when there are none
+        spilled = self._spilled.pop(recipient, None)
+        if spilled is None:
+            return None
+        self.spill_size -= spilled.size
+        return self.run(self.read_spilled, recipient)
+
+    def expire(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        while self._heap and self._heap[0][0] <= now:
+            expires, seq, recipient = heapq.heappop(self._heap)
+            if seq == SPILL:
+                self.expire_spilled(recipient, now)
+                continue
+            queue = self._queues.get(recipient)
+            if queue is None or not seq in queue:
+                continue
+            self.remove(recipient, queue, queue.pop(seq))
+            self.expired += 1
+        self.schedule()
+
+    def expire_spilled(self, recipient: str, now: float):
+        # A spill file is deleted once the last message in it expired
+        spilled = self._spilled.get(recipient)
+        if spilled is None:
+            return
+        if spilled.expires > now:
+            heapq.heappush(self._heap, (spilled.expires, SPILL, recipient))
+            return
+        del self._spilled[recipient]
+        self.spill_size -= spilled.size
+        self.expired += spilled.count
+        self.run(self.unlink_spilled, recipient)
+
+    def schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._heap:
+            return
+        loop = self.loop or asyncio.get_event_loop()
+        self._timer = loop.call_later(max(0.0,
+            self._heap[0][0] - time.time()), self.expire)
+
+    def compact(self):
+        # Drop heap entries of delivered messages once they are the majority
+        if len(self._heap) <= 2 * (self.count + len(self._spilled)) + 64:
+            return
+        self._heap = [entry for entry in self._heap if
+                (entry[1] == SPILL and entry[2] in self._spilled) or
+                (entry[2] in self._queues and
+                    entry[1] in self._queues[entry[2]])]
+        heapq.heapify(self._heap)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._files is not None:
+            self._files.shutdown(wait=True)
+            self._files = None
+
+    def run(self, f, *args) -> asyncio.Future:
+        if self._files is None:
+            self._files = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        loop = self.loop or asyncio.get_event_loop()
+        return loop.run_in_executor(self._files, f, *args)
+
+    def spill_path(self, recipient: str) -> str:
+        return os.path.join(self.spill,
+                recipient.encode(Message.ENCODING).hex() + '.spill')
+
+    def spill_message(self, recipient: str, seq: int, expires: float,
+            sender: str, payload: bytes) -> bool:
+        if self.spill is None or \
+                self.spill_size + len(payload) > self.max_spill_bytes:
+            self.dropped += 1
+            return False
+        spilled = self._spilled.get(recipient)
+        if spilled is None:
+            spilled = self._spilled[recipient] = Spill()
+            self.push(expires, SPILL, recipient)
+        spilled.count += 1
+        spilled.size += len(payload)
+        spilled.expires = max(spilled.expires, expires)
+        self.spill_size += len(payload)
+        header = '%d\n%f\n%s' % (seq, expires, sender)
+        self.run(self.append_spilled, recipient, bytes(Message('offline',
+            header.encode(Message.ENCODING), payload)))
+        return True
+
+    def append_spilled(self, recipient: str, frame: bytes):
+        # Private messages, only readable by this user
+        with open(os.open(self.spill_path(recipient), os.O_WRONLY |
+                os.O_CREAT | os.O_APPEND, 0o600), 'ab') as fd:
+            fd.write(frame)
+
+    def unlink_spilled(self, recipient: str):
+        if os.path.exists(self.spill_path(recipient)):
+            os.unlink(self.spill_path(recipient))
+
+    def read_spilled(self, recipient: str) -> List[Tuple[float, Message]]:
+        if not os.path.exists(self.spill_path(recipient)):
+            return []
+        with open(self.spill_path(recipient), 'rb') as fd:
+            data = fd.read()
+        os.unlink(self.spill_path(recipient))
+        now = time.time()
+        return [(expires, ClientMsg(sender, payload, unencoded=True)) for
+                expires, sender, payload in spilled_entries(data) if
+                expires > now]
+
+    def index(self):
+        # Blocking, called on startup before the loop runs. Expired and
+        # unreadable files are removed
+        now = time.time()
+        for filename in os.listdir(self.spill):
+            name, ext = os.path.splitext(filename)
+            path = os.path.join(self.spill, filename)
+            if ext != '.spill':
+                continue
+            try:
+                recipient = bytes.fromhex(name).decode(Message.ENCODING)
+                with open(path, 'rb') as fd:
+                    entries = spilled_entries(fd.read())
+            except (ValueError, struct.error):
+                entries = []
+            spilled = Spill()
+            for expires, sender, payload in entries:
+                spilled.size += len(payload)
+                if expires > now:
+                    spilled.count += 1
+                    spilled.expires = max(spilled.expires, expires)
+            if not spilled.count:
+                os.unlink(path)
+                continue
+            self._spilled[recipient] = spilled
+            self.spill_size += spilled.size
+            self.push(spilled.expires, SPILL, recipient)
+
+def spilled_entries(data: bytes) -> List[Tuple[float, str, bytes]]:
+    # A write cut short by a crash leaves a partial message at the end
+    entries = []
+    for msg in Message.decode(data[:Message.complete(data,
+            max_size=len(data))]):
+        seq, expires, sender = msg.str_header().split('\n', 2)
+        entries.append((float(expires), sender, msg.payload))
+    return entries
@@ -0,0 +1,69 @@
+import time
+import collections
+from typing import Callable
+
+from .message import Message
+
+# Priority classes, lower is more urgent
+CONTROL = 0
+DIRECT = 1
+BROADCAST = 2
+BULK = 3
+NAMES = ('control', 'direct', 'broadcast', 'bulk')
+# Share of each drain round a class gets when all of them have frames queued
+WEIGHTS = (8, 4, 2, 1)
+QUANTUM = 4096
+
+# Acks, errors and echo (used as a heartbeat) are control frames
+PRIORITIES = {
+    'client_msg': DIRECT,
+    'broadcast': BROADCAST,
+    'room_list': BULK,
+    'member_list': BULK,
+    }
+
+# Refusals take the lane of the reply they stand in for, so that they stay
+# in order with the replies to earlier requests of the same kind
+REFUSED = {
+    'list_rooms': BULK,
+    'room_members': BULK,
+    }
+
+def priority(msg: Message) -> int:
+    if msg.handler == 'server_busy' and msg.header_length:
+        return REFUSED.get(msg.str_header(), CONTROL)
+    return PRIORITIES.get(msg.handler, CONTROL)
+
+class Lanes(object):
+
+    __slots__ = ('_queues', '_deficits', 'size')
+
+    def __init__(self):
+        self._queues = tuple(collections.deque() for name in NAMES)
+        self._deficits = [0] * len(NAMES)
+        # Bytes queued across all lanes
+        self.size = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues)
+
+    def push(self, msg: Message, lane: int):
+        self._queues[lane].append((msg, time.perf_counter()))
+        self.size += len(msg)
+
+    def drain(self, write: Callable[[Message, int, float], bool]) -> bool:
+        # Deficit round robin over the lanes, write returns False once the
+        # transport can take no more. Returns True when all lanes are empty
+        while self.size:
+            for lane, queue in enumerate(self._queues):
+                if not queue:
+                    self._deficits[lane] = 0
+                    continue
+                self._deficits[lane] += WEIGHTS[lane] * QUANTUM
+                while queue and len(queue[0][0]) <= self._deficits[lane]:
+                    msg, enqueued = queue.popleft()
+                    self._deficits[lane] -= len(msg)
+                    self.size -= len(msg)
+                    if not write(msg, lane, enqueued):
+                        return not self.size
+        return True
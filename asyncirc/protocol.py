@@ -1,26 +1,99 @@
+import sys
 import asyncio
 import traceback
 
 from .message import Message
+from . import capture
 
-class BaseProtocol(asyncio.Protocol):
+if sys.version_info >= (3, 8):
+    Protocol = asyncio.Protocol
+else:
+    class Protocol(object):
+
+        # asyncio.Protocol only has __slots__ from 3.8, subclasses of it
+        # would otherwise get an instance dict for every connection.
+        # Transports only need the methods, not the base class
+        __slots__ = ()
+
+        def connection_made(self, transport):
+            pass
+
+        def connection_lost(self, exc):
+            pass
+
+        def pause_writing(self):
+            pass
+
+        def resume_writing(self):
+            pass
+
+        def data_received(self, data):
+            pass
+
+        def eof_received(self):
+            pass
+
+class BaseProtocol(Protocol):
+
+    __slots__ = ('transport', 'recorder', 'partial')
 
     def connection_made(self, transport):
         peername = transport.get_extra_info('peername')
         self.transport = transport
+        self.recorder = None
+        # Start of a message split across reads, None between messages
+        self.partial = None
+
+    def connection_lost(self, exc):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def start_capture(self, frames: capture.Capture):
+        # Frames sent and received from here on are appended to frames
+        self.recorder = frames.open()
+
+    def write_message(self, msg: Message):
+        if self.recorder is not None:
+            self.recorder.record(capture.OUT, msg)
+        # In process transports hand over the message without serializing it
+        write = getattr(self.transport, 'write_message', None)
+        if write is None:
+            return self.transport.write(bytes(msg))
+        return write(msg)
 
     def data_received(self, data):
         if not len(data):
             return
+        partial = self.partial
+        if partial is not None:
+            partial += data
+        try:
+            end = Message.complete(data if partial is None else partial)
+        except ValueError as err:
+            # Not buffered, the peer could otherwise claim any length
+            print('ERROR: %s dropping connection: %s' % (
+                self.__class__.__qualname__, err))
+            self.partial = None
+            self.transport.close()
+            return
+        if partial is None:
+            if end < len(data):
+                # Kept until the rest of the message arrives
+                self.partial = bytearray(data[end:])
+                data = data[:end]
+        else:
+            if not end:
+                return
+            data = bytes(partial[:end])
+            del partial[:end]
+            if not partial:
+                self.partial = None
+        if not end:
+            return
         try:
             for msg in Message.decode(data):
-                try:
-                    self.handle(msg)
-                except Exception as err:
-                    print('ERROR: %s handling message: %s' % (
-                        self.__class__.__qualname__, err))
-                    traceback.print_exc()
-                    self.transport.close()
+                if not self.message_received(msg):
                     return
         except Exception as err:
             print('ERROR: %s while decoding message: %s: %s' % (
@@ -29,5 +102,18 @@ class BaseProtocol(asyncio.Protocol):
             self.transport.close()
             return
 
+    def message_received(self, msg: Message) -> bool:
+        if self.recorder is not None:
+            self.recorder.record(capture.IN, msg)
+        try:
+            self.handle(msg)
+        except Exception as err:
+            print('ERROR: %s handling message: %s' % (
+                self.__class__.__qualname__, err))
+            traceback.print_exc()
+            self.transport.close()
+            return False
+        return True
+
     def handle(self, msg: Message):
         raise NotImplementedError('handle is not implemented')
@@ -0,0 +1,195 @@
+import json
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+
+from .message import Message
+from .server import unix_address
+from . import const, capture
+
+# Frames the server sends without being asked, they answer no request
+UNSOLICITED = ('broadcast', 'client_msg', 'generation')
+
+class Session(object):
+
+    def __init__(self, conn_id: int, opened: float):
+        self.conn_id = conn_id
+        self.opened = opened
+        # Frames the client sent as (seconds into the capture, frame)
+        self.frames = []
+        # Index in frames of the request each reply recorded answered
+        self.replies: List[int] = []
+
+def sessions(records) -> List[Session]:
+    # A reply is taken to answer the last frame its client sent before it
+    if not records:
+        return []
+    start = records[0][1]
+    by_id: Dict[int, Session] = {}
+    for conn_id, timestamp, direction, msg in records:
+        session = by_id.get(conn_id)
+        if session is None:
+            session = by_id[conn_id] = Session(conn_id, timestamp - start)
+        if direction == capture.IN:
+            session.frames.append((timestamp - start, msg))
+        elif direction == capture.OUT and session.frames and \
+                not msg.handler in UNSOLICITED:
+            session.replies.append(len(session.frames) - 1)
+    return [session for session in by_id.values() if session.frames]
+
+def summary(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+    latencies = sorted(latencies)
+    def percentile(percent):
+        return latencies[min(len(latencies) - 1,
+            int(len(latencies) * percent / 100.0))] * 1000.0
+    return {
+        'mean': sum(latencies) / len(latencies) * 1000.0,
+        'p50': percentile(50),
+        'p99': percentile(99),
+        'max': latencies[-1] * 1000.0,
+        }
+
+class Replay(object):
+
+    def __init__(self, connect, speed: float = 1.0, timeout: float = 10.0,
+            loop=asyncio.get_event_loop()):
+        # connect is a coroutine function returning a reader and writer
+        self.connect = connect
+        self.speed = speed
+        self.timeout = timeout
+        self.loop = loop
+        self.sent = 0
+        self.received = 0
+        self.missing = 0
+        self.latencies: List[float] = []
+
+    async def run(self, sessions: List[Session]) -> Dict:
+        start = self.loop.time()
+        await asyncio.gather(*[self.session(session, start) for session
+            in sessions], loop=self.loop)
+        seconds = self.loop.time() - start
+        return {
+            'sessions': len(sessions),
+            'sent': self.sent,
+            'received': self.received,
+            'missing': self.missing,
+            'seconds': seconds,
+            'throughput': (self.sent + self.received) / seconds \
+                    if seconds else 0.0,
+            'latency': summary(self.latencies),
+            }
+
+    async def at(self, start: float, offset: float):
+        delay = start + offset / self.speed - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay, loop=self.loop)
+
+    async def session(self, session: Session, start: float):
+        await self.at(start, session.opened)
+        reader, writer = await self.connect()
+        sent = [None] * len(session.frames)
+        # Number of replies received so far
+        answered = [0]
+        receiver = self.loop.create_task(self.receive(reader, session, sent,
+            answered))
+        for index, (offset, msg) in enumerate(session.frames):
+            await self.at(start, offset)
+            sent[index] = self.loop.time()
+            writer.write(bytes(msg))
+            self.sent += 1
+        try:
+            await asyncio.wait_for(receiver, self.timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            pass
+        self.missing += len(session.replies) - answered[0]
+        writer.close()
+
+    async def receive(self, reader, session: Session,
+            sent: List[Optional[float]], answered: List[int]):
+        # Returns once all replies were received or on EOF
+        while answered[0] < len(session.replies):
+            try:
+                initial = await reader.readexactly(Message.INITIAL.size)
+                body = await reader.readexactly(sum(
+                    Message.INITIAL.unpack(initial)))
+            except asyncio.IncompleteReadError:
+                break
+            self.received += 1
+            msg = next(Message.decode(initial + body))
+            if msg.handler in UNSOLICITED:
+                continue
+            request = sent[session.replies[answered[0]]]
+            if request is not None:
+                self.latencies.append(self.loop.time() - request)
+            answered[0] += 1
+
+def compare(report: Dict, baseline: Dict) -> List[List]:
+    rows = []
+    for name in ('seconds', 'throughput'):
+        rows.append([name, baseline[name], report[name]])
+    for name in ('mean', 'p50', 'p99', 'max'):
+        rows.append(['latency.%s' % (name), baseline['latency'][name],
+            report['latency'][name]])
+    for row in rows:
+        row.append((row[2] - row[1]) / row[1] * 100.0 if row[1] else 0.0)
+    return rows
+
+def cli():
+    parser = argparse.ArgumentParser(description='Replay frames recorded '
+            'with asyncircs --capture against a server')
+    parser.add_argument('capture', type=str, help='Capture file to replay')
+    parser.add_argument('--addr', type=str, default=const.ADDR,
+            help='Address of the server')
+    parser.add_argument('--port', type=int, default=const.PORT,
+            help='Port of the server')
+    parser.add_argument('--unix', type=str, default=None, metavar='PATH',
+            help='Connect over unix socket PATH instead')
+    parser.add_argument('--speed', type=float, default=1.0,
+            help='Times faster than recorded to send frames')
+    parser.add_argument('--timeout', type=float, default=10.0,
+            help='Seconds to wait for replies after the last frame of a '
+            'session was sent')
+    parser.add_argument('--output', type=str, default=None, metavar='FILE',
+            help='Write the report to FILE as JSON')
+    parser.add_argument('--baseline', type=str, default=None, metavar='FILE',
+            help='Compare against the report in FILE from another build')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    if args.unix is None:
+        connect = lambda: asyncio.open_connection(args.addr, args.port,
+                loop=loop)
+    else:
+        connect = lambda: asyncio.open_unix_connection(
+                unix_address(args.unix), loop=loop)
+    replay = Replay(connect, speed=args.speed, timeout=args.timeout,
+            loop=loop)
+    report = loop.run_until_complete(replay.run(sessions(
+        capture.load(args.capture))))
+    loop.close()
+
+    print('{} sessions, {} frames sent, {} received, {} replies missing'\
+            .format(report['sessions'], report['sent'], report['received'],
+                report['missing']))
+    if args.baseline is None:
+        print('{:<14} {:>12.3f}'.format('seconds', report['seconds']))
+        print('{:<14} {:>12.1f} frames/s'.format('throughput',
+            report['throughput']))
+        for name, value in report['latency'].items():
+            print('{:<14} {:>12.3f} ms'.format('latency.' + name, value))
+    else:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+        print('{:<14} {:>12} {:>12} {:>9}'.format('', 'baseline', 'this',
+            'change'))
+        for name, before, after, change in compare(report, baseline):
+            print('{:<14} {:>12.3f} {:>12.3f} {:>+8.1f}%'.format(name,
+                before, after, change))
+    if args.output is not None:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    cli()
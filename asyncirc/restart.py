@@ -0,0 +1,206 @@
+import os
+import array
+import struct
+import socket
+import asyncio
+from typing import List, Optional, Tuple
+
+from .message import Message
+from .server import Server, unix_address
+from . import const, auth
+
+MAX_FDS = 64
+
+def send_fds(sock: socket.socket, data: bytes, fds: List[int]):
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+        array.array('i', fds))])
+
+def recv_fds(sock: socket.socket, size: int,
+        maxfds: int = MAX_FDS) -> Tuple[bytes, List[int]]:
+    fds = array.array('i')
+    data, ancdata, flags, addr = sock.recvmsg(size,
+            socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - \
+                    (len(cmsg_data) % fds.itemsize)])
+    return data, list(fds)
+
+def same_user(sock: socket.socket) -> bool:
+    # Whether the process at the other end of a unix socket runs as this
+    # user. Without SO_PEERCRED only the socket file permissions protect it
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    creds = struct.Struct('3i')
+    pid, uid, gid = creds.unpack(sock.getsockopt(socket.SOL_SOCKET,
+        socket.SO_PEERCRED, creds.size))
+    return uid == os.getuid()
+
+def dump(server: Server) -> bytes:
+    frames = []
+    for room_name, room in server._rooms.items():
+        frames.append(Message('room', room_name.encode(Message.ENCODING),
+            '\n'.join(room.clients()).encode(Message.ENCODING)))
+    for client_name in server._clients:
+        frames.append(Message('client', client_name.encode(Message.ENCODING),
+            b''))
+    for client_name, (salt, key) in server._credentials.items():
+        frames.append(Message('credential',
+            client_name.encode(Message.ENCODING), salt + key))
+    return b''.join(bytes(frame) for frame in frames)
+
+def load(server: Server, data: bytes):
+    for frame in Message.decode(data):
+        if frame.handler == 'room':
+            room_name = frame.str_header()
+            server.create_room(room_name)
+            for client_name in filter(None, frame.str_payload().split('\n')):
+                server.restore_member(client_name, room_name)
+        elif frame.handler == 'client':
+            server._restored.setdefault(frame.str_header(), [])
+        elif frame.handler == 'credential':
+            # Admin passwords come from the operator, not the snapshot
+            if frame.str_header() in server.admins:
+                continue
+            server._credentials[frame.str_header()] = (
+                    frame.payload[:auth.SALT_SIZE],
+                    frame.payload[auth.SALT_SIZE:])
+
+def snapshot(server: Server, path: str):
+    write(path, dump(server))
+
+def write(path: str, data: bytes):
+    # Written beside the old snapshot and renamed so readers never see half.
+    # Only readable by this user as it holds the password hashes
+    tmp = path + '.tmp'
+    fileno = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fileno, 0o600)
+    with open(fileno, 'wb') as fd:
+        fd.write(data)
+    os.replace(tmp, path)
+
+def restore(server: Server, path: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as fd:
+        load(server, fd.read())
+    return True
+
+def takeover(path: str, timeout: float = const.HANDOFF_TIMEOUT) \
+        -> Optional[Tuple[List[socket.socket], str]]:
+    # Blocking, called before the new process starts its loop. Returns None
+    # when no running server is listening for a handoff on path
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(unix_address(path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    with sock:
+        if not same_user(sock):
+            raise PermissionError('handoff %s is held by another user' % (
+                path))
+        sock.settimeout(timeout)
+        data, fds = recv_fds(sock, 64 * 1024)
+        if not data:
+            raise ConnectionResetError('handoff %s refused' % (path))
+        msg = next(Message.decode(data))
+        families = [int(family) for family in msg.str_payload().split(',')]
+        socks = [socket.socket(family, socket.SOCK_STREAM, fileno=fd)
+                for family, fd in zip(families, fds)]
+        sock.sendall(b'ok')
+    return socks, msg.str_header()
+
+class Handoff(object):
+
+    def __init__(self, server: Server, path: str, snapshot: str = None,
+            drain_timeout: float = const.DRAIN_TIMEOUT,
+            loop=asyncio.get_event_loop()):
+        self.server = server
+        self.path = path
+        self.snapshot = path + '.snapshot' if snapshot is None else snapshot
+        self.drain_timeout = drain_timeout
+        self.loop = loop
+        # Done once listeners were handed off and connections drained
+        self.done = asyncio.Future(loop=self.loop)
+        self.handed_off = False
+        self._sock = None
+        self._conn = None
+
+    def listen(self):
+        address = unix_address(self.path)
+        if not self.path.startswith('@') and os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(address)
+        if not self.path.startswith('@'):
+            os.chmod(self.path, 0o600)
+        self._sock.listen(1)
+        self._sock.setblocking(False)
+        self.loop.add_reader(self._sock.fileno(), self._accept)
+
+    def close(self):
+        if self._sock is None:
+            return
+        self.loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        if not self.path.startswith('@') and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _accept(self):
+        try:
+            conn, addr = self._sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        # Abstract names and races with the socket file permissions let
+        # anyone connect, only a process of the same user may take over
+        if not self.trusted(conn):
+            print('WARN: %s refused takeover by another user' % (
+                self.__class__.__qualname__))
+            conn.close()
+            return
+        # Only one process may take over, it then listens on path itself
+        self.close()
+        self._conn = conn
+        self.loop.create_task(self.hand_off(conn))
+
+    def trusted(self, conn: socket.socket) -> bool:
+        return same_user(conn)
+
+    async def hand_off(self, conn: socket.socket):
+        # The snapshot is taken on the loop, writing it and sending the fds
+        # block so are done on an executor
+        data = dump(self.server)
+        await self.loop.run_in_executor(None, write, self.snapshot, data)
+        listeners = self.server.listeners()
+        msg = Message('handoff', self.snapshot.encode(Message.ENCODING),
+                ','.join(str(int(sock.family)) for sock in listeners)\
+                        .encode(Message.ENCODING))
+        conn.settimeout(const.HANDOFF_TIMEOUT)
+        try:
+            await self.loop.run_in_executor(None, send_fds, conn, bytes(msg),
+                    [sock.fileno() for sock in listeners])
+        except OSError:
+            pass
+        conn.setblocking(False)
+        self.loop.add_reader(conn.fileno(), self._acked)
+
+    def _acked(self):
+        self.loop.remove_reader(self._conn.fileno())
+        try:
+            ack = self._conn.recv(2)
+        except OSError:
+            ack = b''
+        self._conn.close()
+        self._conn = None
+        if ack != b'ok':
+            print('WARN: %s takeover aborted, keep serving' % (
+                self.__class__.__qualname__))
+            return self.listen()
+        # The new process accepts on the same sockets from here on
+        self.handed_off = True
+        self.server.close(unlink=False)
+        task = self.loop.create_task(self.server.drain(self.drain_timeout,
+            loop=self.loop))
+        task.add_done_callback(lambda task: self.done.set_result(True))
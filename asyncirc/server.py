@@ -1,22 +1,119 @@
+import os
+import sys
+import hmac
+import math
+import time
+import signal
+import socket
+import itertools
 import asyncio
 import inspect
 import argparse
+import collections
+import traceback
+import multiprocessing
+import concurrent.futures
 
 from functools import wraps
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
+from .index import SortedIndex
+from .metrics import Metrics
+from .monitor import LagMonitor, Profiler
+from .offline import OfflineStore
 from .protocol import BaseProtocol
-from . import message, const
+from . import message, const, auth, outbound, capture
+
+# Process pools can then start workers which do not inherit open sockets
+FORKSERVER = sys.version_info >= (3, 7) and \
+        'forkserver' in multiprocessing.get_all_start_methods()
+
+LATENCY = tuple('outbound.%s.latency' % (name) for name in outbound.NAMES)
 
 class ClientHandler(BaseProtocol):
 
+    __slots__ = ('name', 'identified', 'server', 'id', 'rooms', 'backlog',
+            'reading_paused', 'lanes', 'writing_paused')
+
     def __init__(self, server):
         self.name = ''
         self.identified = False
         self.server = server
+        # Assigned on identify, rooms counts the rooms the client is in
+        self.id = 0
+        self.rooms = 0
+        # Messages waiting behind offloaded work, None when there is none
+        self.backlog = None
+        self.reading_paused = False
+        # Frames waiting for the transport by priority, None when there are
+        # none. The transport buffer is kept small so they queue here instead
+        # and control frames can overtake bulk ones
+        self.lanes = None
+        self.writing_paused = False
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        transport.set_write_buffer_limits(high=const.WRITE_HIGH_WATER)
+        if not self.server.connection_made(self):
+            return
+        if self.server.capture is not None:
+            self.start_capture(self.server.capture)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if self.lanes is not None:
+            self.server.metrics.adjust('outbound.queued', -self.lanes.size)
+            self.lanes = None
+        self.server.connection_lost(self)
+
+    def data_received(self, data):
+        # Decoding and inline handlers of every frame in data together
+        start = time.perf_counter()
+        super().data_received(data)
+        self.server.callback_time('data_received',
+                time.perf_counter() - start)
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.lanes is None:
+            return
+        size = self.lanes.size
+        drained = self.lanes.drain(self.write_queued)
+        self.server.metrics.adjust('outbound.queued', self.lanes.size - size)
+        if drained:
+            self.lanes = None
+
+    def send_batch(self, msgs: List[message.Message]):
+        # One write for all of msgs when nothing is queued ahead of them
+        if self.writing_paused or self.lanes is not None:
+            for msg in msgs:
+                self.send(msg)
+            return
+        for msg in msgs:
+            self.server.metrics.timing(LATENCY[outbound.priority(msg)], 0.0)
+            if self.recorder is not None:
+                self.recorder.record(capture.OUT, msg)
+        self.transport.write(b''.join(bytes(msg) for msg in msgs))
 
     def send(self, msg: message.Message):
-        self.transport.write(bytes(msg))
+        lane = outbound.priority(msg)
+        if not self.writing_paused and self.lanes is None:
+            self.server.metrics.timing(LATENCY[lane], 0.0)
+            return self.write_message(msg)
+        if self.lanes is None:
+            self.lanes = outbound.Lanes()
+        self.lanes.push(msg, lane)
+        self.server.metrics.adjust('outbound.queued', len(msg))
+
+    def write_queued(self, msg: message.Message, lane: int,
+            enqueued: float) -> bool:
+        self.server.metrics.timing(LATENCY[lane],
+                time.perf_counter() - enqueued)
+        self.write_message(msg)
+        return not self.writing_paused
 
     def disconnect(self):
         self.transport.close()
@@ -27,20 +124,99 @@ class ClientHandler(BaseProtocol):
             print('WARN: %s handler not found: %s' % (
                 self.__class__.__qualname__, msg.handler))
             return self.send(message.NotFound)
-        return handler(self, msg)
+        if self.backlog is None and \
+                self.server.modes.get(msg.handler) is None:
+            start = time.perf_counter()
+            try:
+                return handler(self, msg)
+            finally:
+                self.server.callback_time('handler.' + msg.handler,
+                        time.perf_counter() - start)
+        # Keep messages in order behind anything not handled inline
+        if self.backlog is None:
+            self.backlog = collections.deque()
+            asyncio.get_event_loop().create_task(self.run_backlog())
+        self.backlog.append((handler, msg))
+        if len(self.backlog) >= self.server.max_pending and \
+                not self.reading_paused and not self.transport.is_closing():
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    async def run_backlog(self):
+        server = self.server
+        while self.backlog and not self.transport.is_closing():
+            handler, msg = self.backlog[0]
+            try:
+                await server.run(self, handler, msg)
+            except Exception as err:
+                print('ERROR: %s handling message: %s' % (
+                    self.__class__.__qualname__, err))
+                traceback.print_exc()
+                self.transport.close()
+                break
+            self.backlog.popleft()
+            if self.reading_paused and \
+                    len(self.backlog) <= server.max_pending // 2:
+                self.reading_paused = False
+                self.transport.resume_reading()
+        self.backlog = None
 
 class Handler(object):
 
+    # How the server runs the handler. Inline and coroutine handlers are
+    # called on the event loop. Thread and process handlers have work called
+    # on an executor with the message, then done called on the loop with the
+    # result. Process handlers are pickled without their server to do so
+    INLINE = None
+    COROUTINE = 'coroutine'
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+    mode = INLINE
+
     def __init__(self, server):
         self.server = server
 
     def __call__(self, client: ClientHandler, msg: message.Message):
         raise NotImplementedError('handler is not implemented')
 
+    def work(self, msg: message.Message):
+        raise NotImplementedError('work is not implemented')
+
+    def done(self, client: ClientHandler, msg: message.Message, result):
+        if isinstance(result, message.Message):
+            client.send(result)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('server', None)
+        return state
+
+# pbkdf2 releases the GIL, threads stand in for processes without forkserver
+KDF_MODE = Handler.PROCESS if FORKSERVER else Handler.THREAD
+
+def process_pool() -> concurrent.futures.ProcessPoolExecutor:
+    if FORKSERVER:
+        return concurrent.futures.ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context('forkserver'))
+    return concurrent.futures.ProcessPoolExecutor()
+
+def handler_mode(handler) -> Optional[str]:
+    mode = getattr(handler, 'mode', Handler.INLINE)
+    if mode is Handler.INLINE and (asyncio.iscoroutinefunction(handler) or \
+            asyncio.iscoroutinefunction(getattr(handler, '__call__', None))):
+        return Handler.COROUTINE
+    return mode
+
 class BaseServer(object):
 
     def __init__(self, handler: Optional[ClientHandler] = ClientHandler,
-            handlers: Dict[str, Handler] = {}):
+            handlers: Dict[str, Handler] = {},
+            executors: Dict[str, concurrent.futures.Executor] = {},
+            max_pending: int = const.MAX_PENDING,
+            slow_callback: float = const.SLOW_CALLBACK,
+            profile_dir: Optional[str] = None,
+            capture: Optional[capture.Capture] = None):
         self.handler = handler
         built_ins = {
             name.replace('handle_', ''): method \
@@ -50,10 +226,99 @@ class BaseServer(object):
         # Override built in handlers with supplied
         built_ins.update(handlers)
         self.handlers = built_ins
+        # Only handlers which are not run inline have a mode
+        self.modes = {}
+        for name, handler in self.handlers.items():
+            mode = handler_mode(handler)
+            if not mode is Handler.INLINE:
+                self.modes[name] = mode
+        self.executors = dict(executors)
+        self.max_pending = max_pending
+        self.slow_callback = slow_callback
+        self.metrics = Metrics()
+        # Lag is sampled once started, the profiler records on request
+        self.monitor = LagMonitor(self.metrics)
+        self.profiler = Profiler(profile_dir)
+        # Frames of every connection are recorded to it when given
+        self.capture = capture
+        self._connections = set()
+        self._drained = None
 
     def __call__(self):
         return self.handler(self)
 
+    def executor(self, mode: str) -> concurrent.futures.Executor:
+        if not mode in self.executors:
+            if mode == Handler.PROCESS:
+                self.executors[mode] = process_pool()
+            else:
+                self.executors[mode] = concurrent.futures.ThreadPoolExecutor()
+        return self.executors[mode]
+
+    def start_executors(self):
+        # Forked process workers are started before there are connections for
+        # them to inherit, an inherited socket stays open after it is closed
+        if not FORKSERVER and Handler.PROCESS in self.modes.values():
+            self.executor(Handler.PROCESS).submit(int).result()
+
+    def shutdown(self, wait: bool = True):
+        self.monitor.stop()
+        self.profiler.stop()
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
+        if self.capture is not None:
+            self.capture.close()
+
+    def callback_time(self, name: str, seconds: float):
+        # Attributes callbacks which held up the loop to what they ran
+        if seconds < self.slow_callback:
+            return
+        self.metrics.incr('slow.' + name)
+        self.metrics.timing('slow.' + name, seconds)
+        print('WARN: %s %s blocked the loop for %.3fs' % (
+            self.__class__.__qualname__, name, seconds))
+
+    async def run(self, client: ClientHandler, handler, msg: message.Message):
+        mode = self.modes.get(msg.handler)
+        if mode is Handler.INLINE:
+            return handler(client, msg)
+        if mode == Handler.COROUTINE:
+            return await handler(client, msg)
+        pending = 'executor.%s.pending' % (mode)
+        self.metrics.incr('executor.%s.submitted' % (mode))
+        self.metrics.adjust(pending, 1)
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(
+                    self.executor(mode), handler.work, msg)
+        finally:
+            self.metrics.adjust(pending, -1)
+        start = time.perf_counter()
+        handler.done(client, msg, result)
+        self.callback_time('handler.' + msg.handler,
+                time.perf_counter() - start)
+
+    def connection_made(self, client: ClientHandler) -> bool:
+        # Returns False when the connection was not admitted
+        self._connections.add(client)
+        return True
+
+    def connection_lost(self, client: ClientHandler):
+        self._connections.discard(client)
+        if not self._connections and self._drained is not None and \
+                not self._drained.done():
+            self._drained.set_result(True)
+
+    async def drain(self, timeout: float, loop=asyncio.get_event_loop()):
+        # Wait for connected clients to leave, then disconnect the rest
+        if self._connections:
+            self._drained = asyncio.Future(loop=loop)
+            try:
+                await asyncio.wait_for(self._drained, timeout, loop=loop)
+            except asyncio.TimeoutError:
+                pass
+        for client in list(self._connections):
+            client.disconnect()
+
     def handle_echo(self, client: ClientHandler, msg: message.Message):
         client.send(msg)
 
@@ -62,24 +327,58 @@ class BaseServer(object):
 
 class Room(object):
 
-    def __init__(self, name: str):
+    __slots__ = ('name', '_members', '_index', '_ids')
+
+    def __init__(self, name: str, ids: Dict[int, ClientHandler]):
         self.name = name
-        self._clients: Dict[str, ClientHandler] = {}
+        # Members by client id in join order, looked up in the server wide
+        # ids registry
+        self._members = {}
+        self._index = SortedIndex()
+        self._ids = ids
 
     def join(self, client: ClientHandler):
-        self._clients[client.name] = client
+        self.add(client)
         client.send(message.RoomJoined)
 
+    def add(self, client: ClientHandler):
+        if client.id in self._members:
+            return
+        self._members[client.id] = None
+        self._index.add(client.name)
+        client.rooms += 1
+
     def leave(self, client: ClientHandler):
-        if client.name in self._clients:
-            self._clients.pop(client.name)
+        if client.id in self._members:
+            del self._members[client.id]
+            self._index.discard(client.name)
+            client.rooms -= 1
+
+    def __contains__(self, client: ClientHandler):
+        return client.id in self._members
+
+    def __len__(self):
+        return len(self._members)
 
     def clients(self):
-        return list(self._clients.keys())
+        return [self._ids[client_id].name for client_id in self._members]
+
+    def page(self, limit: int, cursor: str = '', prefix: str = ''):
+        return self._index.page(limit, cursor, prefix)
 
     def broadcast(self, client: ClientHandler, msg: message.Message):
-        for relay in self._clients.values():
-            relay.send(message.Broadcast(self.name, client.name, msg.payload))
+        relayed = message.Broadcast(self.name, client.name, msg.payload)
+        for client_id in self._members:
+            self._ids[client_id].send(relayed)
+
+def unix_address(path: str) -> str:
+    # Paths starting with @ are in the Linux abstract namespace
+    if path.startswith('@'):
+        return '\0' + path[1:]
+    return path
+
+def page_limit(limit: int) -> int:
+    return max(1, min(limit, const.MAX_PAGE_SIZE))
 
 def IDd(f):
     @wraps(f)
@@ -92,21 +391,211 @@ def IDd(f):
 class Server(BaseServer):
 
     def __init__(self, handler: Optional[ClientHandler] = ClientHandler,
-            handlers: Dict[str, Handler] = {}):
-        super().__init__(handler, handlers)
+            handlers: Dict[str, Handler] = {},
+            kdf_iterations: int = const.KDF_ITERATIONS,
+            max_kdf_pending: int = const.MAX_KDF_PENDING,
+            credential_ttl: float = const.CREDENTIAL_TTL,
+            offline: Optional[OfflineStore] = None,
+            admins: Dict[str, bytes] = {},
+            max_connections: Optional[int] = None,
+            max_unidentified: Optional[int] = None,
+            identify_deadline: Optional[float] = None,
+            shed_lag: Optional[float] = None,
+            shed_buffered: Optional[int] = None, **kwds):
+        super().__init__(handler, handlers, **kwds)
+        # Limits are off when None. Past shed_lag seconds of loop lag or
+        # shed_buffered bytes queued for clients broadcasts and listings are
+        # refused with server_busy, other requests are still answered
+        self.max_connections = max_connections
+        self.max_unidentified = max_unidentified
+        self.identify_deadline = identify_deadline
+        self.shed_lag = shed_lag
+        self.shed_buffered = shed_buffered
+        # Bytes in the transport buffers of every connection, summed at most
+        # once every BUFFERED_INTERVAL
+        self._transport_buffered = 0
+        self._buffered_due = 0.0
+        # Bumped whenever rooms or their members change and pushed to the
+        # watching clients, at most once per loop iteration
+        self.generation = 0
+        self._watchers = set()
+        self._push = None
+        # Connections yet to identify and their identify deadline timer
+        self._unidentified: Dict[ClientHandler, Optional[asyncio.Handle]] = {}
+        # Client names allowed to send admin messages such as profile
+        self.admins = frozenset(admins)
+        # Holds private messages for clients which are not connected.
+        # Messages sent to a client while its spilled ones are read wait here
+        # so they are delivered after them
+        self.offline = offline
+        self._spilling: Dict[ClientHandler, List[message.Message]] = {}
+        self.kdf_iterations = kdf_iterations
+        self.max_kdf_pending = max_kdf_pending
+        # Salt and derived key for password protected client names
+        self._credentials: Dict[str, Tuple[bytes, bytes]] = {}
+        self._verified = auth.CredentialCache(ttl=credential_ttl)
+        # Admin names are protected by the operator's passwords from the
+        # start so that no client can register them first
+        for client_name, password in admins.items():
+            salt = auth.new_salt()
+            self._credentials[client_name] = (salt, auth.derive(password,
+                salt, kdf_iterations))
+        self._kdf_pending = 0
         self._clients: Dict[str, List[Message]] = {}
         self._rooms: Dict[str, List[Message]] = {}
+        self._room_index = SortedIndex()
+        # Identified clients by id, kept while they are in any room
+        self._ids: Dict[int, ClientHandler] = {}
+        self._next_id = itertools.count(1)
+        # Ids of disconnected clients still in rooms by name, a client which
+        # identifies with the name takes over the id and so the memberships
+        self._stale: Dict[str, int] = {}
+        # Rooms clients were in before a restart, rejoined on identify
+        self._restored: Dict[str, List[str]] = {}
+        self._socks = []
+        self._unix_paths = []
         self.port: int = 0
 
     @classmethod
     def start(cls, addr=const.ADDR, port=const.PORT,
-            loop=asyncio.get_event_loop()):
-        self = cls()
-        coro = loop.create_server(self, addr, port)
-        self._sock = loop.run_until_complete(coro)
-        self.port = self._sock.sockets[0].getsockname()[1]
+            loop=asyncio.get_event_loop(),
+            unix: Union[str, Iterable[str]] = (),
+            socks: Iterable[socket.socket] = (), **kwds):
+        # port of None only listens on the unix sockets. Already listening
+        # socks, such as those handed off on restart, replace addr and unix.
+        # Remaining keyword arguments are passed to the server
+        self = cls(**kwds)
+        self.start_executors()
+        self.monitor.loop = self.profiler.loop = loop
+        self.monitor.start()
+        if isinstance(unix, str):
+            unix = [unix]
+        socks = list(socks)
+        if socks:
+            port, unix = None, ()
+        for sock in socks:
+            if sock.family == socket.AF_UNIX:
+                coro = loop.create_unix_server(self, sock=sock)
+                path = sock.getsockname()
+                if isinstance(path, str) and path and path[0] != '\0':
+                    self._unix_paths.append(path)
+            else:
+                coro = loop.create_server(self, sock=sock)
+                if not self.port:
+                    self.port = sock.getsockname()[1]
+            self._socks.append(loop.run_until_complete(coro))
+        if port is not None:
+            coro = loop.create_server(self, addr, port)
+            self._socks.append(loop.run_until_complete(coro))
+            self.port = self._socks[0].sockets[0].getsockname()[1]
+        for path in unix:
+            coro = loop.create_unix_server(self, unix_address(path))
+            self._socks.append(loop.run_until_complete(coro))
+            self._unix_paths.append(path)
+        self._sock = self._socks[0]
         return self
 
+    def shutdown(self, wait: bool = True):
+        super().shutdown(wait=wait)
+        if self.offline is not None:
+            self.offline.close()
+        if self._push is not None:
+            self._push.cancel()
+            self._push = None
+
+    def listeners(self) -> List[socket.socket]:
+        return [sock for server in self._socks for sock in server.sockets]
+
+    def connection_made(self, client: ClientHandler) -> bool:
+        if self.max_connections is not None and \
+                len(self._connections) >= self.max_connections:
+            return self.refuse(client, 'shed.connections')
+        if self.max_unidentified is not None and \
+                len(self._unidentified) >= self.max_unidentified:
+            return self.refuse(client, 'shed.unidentified')
+        super().connection_made(client)
+        timer = None
+        if self.identify_deadline is not None:
+            timer = asyncio.get_event_loop().call_later(
+                    self.identify_deadline, self.identify_expired, client)
+        self._unidentified[client] = timer
+        self.metrics.gauge('connections', len(self._connections))
+        return True
+
+    def refuse(self, client: ClientHandler, reason: str) -> bool:
+        self.metrics.incr(reason)
+        client.send(message.ServerBusy())
+        client.disconnect()
+        return False
+
+    def identify_expired(self, client: ClientHandler):
+        if self._unidentified.pop(client, False) is False:
+            return
+        self.metrics.incr('shed.identify_deadline')
+        client.disconnect()
+
+    def cancel_deadline(self, client: ClientHandler):
+        timer = self._unidentified.pop(client, None)
+        if timer is not None:
+            timer.cancel()
+
+    def overloaded(self) -> bool:
+        if self.shed_lag is not None and self.monitor.lag >= self.shed_lag:
+            return True
+        return self.shed_buffered is not None and \
+                self.buffered() >= self.shed_buffered
+
+    def buffered(self) -> int:
+        # Bytes queued in the lanes, which the gauge tracks as they change,
+        # and in the transport buffers, which drain without telling us
+        now = time.monotonic()
+        if now >= self._buffered_due:
+            self._buffered_due = now + const.BUFFERED_INTERVAL
+            self._transport_buffered = sum(
+                    client.transport.get_write_buffer_size() for client in
+                    self._connections)
+            self.metrics.gauge('outbound.buffered', self._transport_buffered)
+        return self.metrics.gauges.get('outbound.queued', 0) + \
+                self._transport_buffered
+
+    def shed(self, client: ClientHandler, msg: message.Message) -> bool:
+        # Refuses low priority work while overloaded
+        if not self.overloaded():
+            return False
+        self.metrics.incr('shed.' + msg.handler)
+        client.send(message.ServerBusy(msg.handler))
+        return True
+
+    def connection_lost(self, client: ClientHandler):
+        super().connection_lost(client)
+        self.cancel_deadline(client)
+        self._watchers.discard(client)
+        self.metrics.gauge('connections', len(self._connections))
+        if client.identified and self._clients.get(client.name) is client:
+            del self._clients[client.name]
+        if not client.rooms:
+            self._ids.pop(client.id, None)
+        elif client.identified and self._ids.get(client.id) is client:
+            self._stale[client.name] = client.id
+
+    def restore_member(self, client_name: str, room_name: str):
+        self.create_room(room_name)
+        self._restored.setdefault(client_name, []).append(room_name)
+
+    def close(self, unlink: bool = True):
+        for sock in self._socks:
+            sock.close()
+        if not unlink:
+            self._unix_paths = []
+        for path in self._unix_paths:
+            if not path.startswith('@') and os.path.exists(path):
+                os.unlink(path)
+        self._unix_paths = []
+
+    async def wait_closed(self):
+        for sock in self._socks:
+            await sock.wait_closed()
+
     def handle_terminate(self, client: ClientHandler, msg: message.Message):
         client.transport.close()
         if client.identified and client.name in self._clients:
@@ -115,84 +604,391 @@ class Server(BaseServer):
     def handle_identify(self, client: ClientHandler, msg: message.Message):
         if client.identified:
             return client.send(message.Identified)
-        client_name = msg.str_payload()
+        client_name = sys.intern(msg.str_payload())
         if client_name in self._clients:
             return client.send(message.IDTaken)
+        if client_name in self._credentials:
+            return client.send(message.IDProtected)
+        self.identify(client, client_name)
+
+    async def handle_id_prove(self, client: ClientHandler,
+            msg: message.Message):
+        password = msg.payload
+        if client.identified:
+            # Protects the name the client already identified with
+            if not client.name in self._credentials and \
+                    not await self.register(client, client.name, password):
+                return
+            return client.send(message.Identified)
+        client_name = sys.intern(msg.str_header())
+        if client_name in self._clients:
+            return client.send(message.IDTaken)
+        credentials = self._credentials.get(client_name)
+        if credentials is None:
+            if not await self.register(client, client_name, password):
+                return
+        elif not self._verified.verified(client_name, password,
+                credentials[0]):
+            self.metrics.incr('auth.cache_misses')
+            key = await self.derive(client, password, credentials[0])
+            if key is None:
+                return
+            if not hmac.compare_digest(key, credentials[1]):
+                self.metrics.incr('auth.rejected')
+                return client.send(message.IDRejected)
+            self._verified.add(client_name, password, credentials[0])
+        else:
+            self.metrics.incr('auth.cache_hits')
+        # Another client may have identified while the key was derived
+        if client_name in self._clients:
+            return client.send(message.IDTaken)
+        self.identify(client, client_name)
+
+    async def register(self, client: ClientHandler, client_name: str,
+            password: bytes) -> bool:
+        salt = auth.new_salt()
+        key = await self.derive(client, password, salt)
+        if key is None:
+            return False
+        if client_name in self._credentials:
+            client.send(message.IDRejected)
+            return False
+        self._credentials[client_name] = (salt, key)
+        self._verified.add(client_name, password, salt)
+        return True
+
+    async def derive(self, client: ClientHandler, password: bytes,
+            salt: bytes) -> Optional[bytes]:
+        # Key derivation is kept off the loop and its queue bounded, past
+        # that the client is told to try again later
+        if self._kdf_pending >= self.max_kdf_pending:
+            self.metrics.incr('auth.busy')
+            client.send(message.ServerBusy('id_prove'))
+            return None
+        self._kdf_pending += 1
+        self.metrics.gauge('auth.pending', self._kdf_pending)
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                    self.executor(KDF_MODE), auth.derive, password, salt,
+                    self.kdf_iterations)
+        finally:
+            self._kdf_pending -= 1
+            self.metrics.gauge('auth.pending', self._kdf_pending)
+
+    def identify(self, client: ClientHandler, client_name: str):
         self._clients[client_name] = client
         client.name = client_name
         client.identified = True
+        stale = self._stale.pop(client_name, None)
+        if stale is None:
+            client.id = next(self._next_id)
+        else:
+            client.id = stale
+            client.rooms = self._ids[stale].rooms
+        self._ids[client.id] = client
+        self.cancel_deadline(client)
+        for room_name in self._restored.pop(client_name, ()):
+            self._rooms[room_name].add(client)
+            self.changed()
         client.send(message.Identified)
+        if self.offline is not None:
+            stored = self.offline.take(client_name)
+            if stored:
+                self.metrics.incr('offline.delivered', len(stored))
+                client.send_batch(stored)
+            spilled = self.offline.take_spilled(client_name)
+            if spilled is not None:
+                self._spilling[client] = []
+                spilled.add_done_callback(lambda future:
+                        self.deliver_spilled(client, future))
+
+    def deliver_spilled(self, client: ClientHandler, future: asyncio.Future):
+        sent = self._spilling.pop(client, [])
+        stored = [] if future.cancelled() or future.exception() else \
+                future.result()
+        # Held again should the client have left while they were read
+        if client.transport.is_closing():
+            for expires, msg in stored:
+                self.offline.put(client.name, msg.str_header(), msg.payload,
+                        expires=expires)
+            for msg in sent:
+                self.offline.put(client.name, msg.str_header(), msg.payload)
+            return
+        msgs = [msg for expires, msg in stored] + sent
+        if stored:
+            self.metrics.incr('offline.delivered', len(stored))
+        if msgs:
+            client.send_batch(msgs)
+
+    def admin(self, client: ClientHandler) -> bool:
+        # Clients can only identify with an admin name using its password
+        return client.identified and client.name in self.admins
 
     @IDd
-    def handle_create_room(self, client: ClientHandler, msg: message.Message):
-        room_name = msg.str_payload()
+    def handle_profile(self, client: ClientHandler, msg: message.Message):
+        if not self.admin(client):
+            return client.send(message.NotAdmin)
+        try:
+            seconds = float(msg.str_payload()) if msg.payload_length \
+                    else const.PROFILE_SECONDS
+        except ValueError:
+            seconds = math.nan
+        if not math.isfinite(seconds) or seconds < 0:
+            return client.send(message.BadRequest)
+        path = self.profiler.start(seconds)
+        if path is None:
+            return client.send(message.ServerBusy(msg.handler))
+        client.send(message.Profiling(path))
+
+    def create_room(self, room_name: str) -> Room:
         if not room_name in self._rooms:
-            self._rooms[room_name] = Room(room_name)
+            room_name = sys.intern(room_name)
+            self._rooms[room_name] = Room(room_name, self._ids)
+            self._room_index.add(room_name)
+            self.changed()
+        return self._rooms[room_name]
+
+    def changed(self):
+        self.generation += 1
+        if self._watchers and self._push is None:
+            self._push = asyncio.get_event_loop().call_soon(
+                    self.push_generation)
+
+    def push_generation(self):
+        self._push = None
+        generation = message.Generation(self.generation)
+        for client in self._watchers:
+            client.send(generation)
+
+    @IDd
+    def handle_watch(self, client: ClientHandler, msg: message.Message):
+        self._watchers.add(client)
+        client.send(message.Generation(self.generation))
+
+    @IDd
+    def handle_create_room(self, client: ClientHandler, msg: message.Message):
+        self.create_room(msg.str_payload())
         return client.send(message.RoomCreated)
 
     @IDd
     def handle_list_rooms(self, client: ClientHandler, msg: message.Message):
-        return client.send(message.RoomList(self._rooms.keys()))
+        if self.shed(client, msg):
+            return
+        query = message.parse_page_query(msg)
+        if query is None:
+            return client.send(message.RoomList(self._rooms.keys()))
+        limit, cursor, prefix = query
+        rooms, cursor = self._room_index.page(page_limit(limit), cursor,
+                prefix)
+        return client.send(message.RoomList(rooms, cursor))
 
     @IDd
     def handle_join_room(self, client: ClientHandler, msg: message.Message):
-        room_name = msg.str_payload()
-        if not room_name in self._rooms:
-            self._rooms[room_name] = Room(room_name)
-        self._rooms[room_name].join(client)
+        room = self.create_room(msg.str_payload())
+        if not client in room:
+            self.changed()
+        room.join(client)
 
     @IDd
     def handle_leave_room(self, client: ClientHandler, msg: message.Message):
         room_name = msg.str_payload()
-        if room_name in self._rooms:
+        if room_name in self._rooms and client in self._rooms[room_name]:
             self._rooms[room_name].leave(client)
+            self.changed()
         client.send(message.RoomLeft)
 
     @IDd
     def handle_room_members(self, client: ClientHandler, msg: message.Message):
+        if self.shed(client, msg):
+            return
         room_name = msg.str_payload()
+        query = message.parse_page_query(msg)
         if not room_name in self._rooms:
-            return
-        client.send(message.MemberList(self._rooms[room_name].clients()))
+            # Every listing is answered, clients match replies to requests
+            # by their order
+            return client.send(message.MemberList([]))
+        room = self._rooms[room_name]
+        if query is None:
+            return client.send(message.MemberList(room.clients()))
+        limit, cursor, prefix = query
+        members, cursor = room.page(page_limit(limit), cursor, prefix)
+        client.send(message.MemberList(members, cursor))
 
     @IDd
     def handle_msg_room(self, client: ClientHandler, msg: message.Message):
         room_name = msg.str_header()
         if not room_name in self._rooms:
             return client.send(message.NoRoom)
+        if self.shed(client, msg):
+            return
         self._rooms[room_name].broadcast(client, msg)
         client.send(message.RoomMsgd)
 
     @IDd
     def handle_msg_client(self, client: ClientHandler, msg: message.Message):
-        client_name = msg.str_header()
+        client_name = message.MsgClient.client_name(msg)
         if not client_name in self._clients:
+            try:
+                ttl = message.MsgClient.ttl(msg)
+            except ValueError:
+                ttl = 0.0
+            # The store refuses ttls which are not positive and finite
+            if self.offline is not None and \
+                    self.offline.put(client_name, client.name, msg.payload,
+                            ttl=ttl):
+                self.metrics.incr('offline.stored')
+                return client.send(message.ClientMsgQueued)
             return client.send(message.NoClient(client_name))
-        self._clients[client_name].send(message.ClientMsg(client.name,
-            msg.payload, unencoded=True))
+        relayed = message.ClientMsg(client.name, msg.payload, unencoded=True)
+        recipient = self._clients[client_name]
+        if recipient in self._spilling:
+            self._spilling[recipient].append(relayed)
+        else:
+            recipient.send(relayed)
         client.send(message.ClientMsgd)
 
+def read_admins(path: str) -> Dict[str, bytes]:
+    admins = {}
+    with open(path, 'rb') as fd:
+        for line in fd.read().splitlines():
+            if not line.strip():
+                continue
+            client_name, sep, password = line.partition(b':')
+            if not sep or not password:
+                raise ValueError('%s: expected NAME:PASSWORD lines' % (path))
+            admins[client_name.decode(message.Message.ENCODING)] = password
+    return admins
+
 def cli():
     parser = argparse.ArgumentParser(description='asyncirc server')
     parser.add_argument('--addr', type=str, default=const.ADDR,
             help='Address to bind to')
     parser.add_argument('--port', type=int, default=const.PORT,
             help='Port to bind to')
+    parser.add_argument('--unix', type=str, action='append', default=[],
+            metavar='PATH', help='Also listen on unix socket PATH, '
+            'prefix with @ for the abstract namespace')
+    parser.add_argument('--snapshot', type=str, default=None,
+            metavar='FILE', help='Load room and identity state from FILE '
+            'on startup and save it there on shutdown')
+    parser.add_argument('--handoff', type=str, default=None, metavar='PATH',
+            help='Take over the listening sockets of the server running '
+            'with the same --handoff PATH, then wait on PATH to hand them '
+            'to the next one')
+    parser.add_argument('--drain-timeout', type=float,
+            default=const.DRAIN_TIMEOUT, help='Seconds to wait for clients '
+            'to disconnect after handing off before disconnecting them')
+    parser.add_argument('--offline', action='store_true', default=False,
+            help='Hold private messages for clients which are not connected')
+    parser.add_argument('--offline-ttl', type=float,
+            default=const.OFFLINE_TTL,
+            help='Seconds to hold a private message for when the sender does '
+            'not say')
+    parser.add_argument('--offline-spill', type=str, default=None,
+            metavar='DIR', help='Directory to write held messages to once '
+            'they take more than --offline-max-bytes of memory, those left '
+            'there by a previous run are held until they expire')
+    parser.add_argument('--offline-max-bytes', type=int,
+            default=const.OFFLINE_MAX_BYTES,
+            help='Bytes of held messages to keep in memory')
+    parser.add_argument('--offline-max-spill-bytes', type=int,
+            default=const.OFFLINE_MAX_SPILL_BYTES,
+            help='Bytes of held messages to write to --offline-spill')
+    parser.add_argument('--admin-file', type=str, default=None,
+            metavar='FILE', help='File of NAME:PASSWORD lines, a client '
+            'which identifies as NAME with PASSWORD may send admin messages')
+    parser.add_argument('--profile-dir', type=str, default=None,
+            metavar='DIR', help='Directory to write profiles to, on SIGUSR1 '
+            'one is recorded for --profile-seconds')
+    parser.add_argument('--profile-seconds', type=float,
+            default=const.PROFILE_SECONDS, help='Seconds to profile for on '
+            'SIGUSR1')
+    parser.add_argument('--slow-callback', type=float,
+            default=const.SLOW_CALLBACK, help='Seconds a handler may block '
+            'the loop for before it is reported')
+    parser.add_argument('--capture', type=str, default=None,
+            metavar='FILE', help='Record the frames of every connection to '
+            'FILE for asyncirc-replay, passwords are replaced by an HMAC '
+            'under a key never written out, all other payloads are kept')
+    parser.add_argument('--max-connections', type=int,
+            default=const.MAX_CONNECTIONS, help='Connections to accept at '
+            'once, past this new ones are told the server is busy')
+    parser.add_argument('--max-unidentified', type=int,
+            default=const.MAX_UNIDENTIFIED, help='Connections which have '
+            'not identified yet to accept at once')
+    parser.add_argument('--identify-deadline', type=float,
+            default=const.IDENTIFY_DEADLINE, help='Seconds a connection has '
+            'to identify before it is disconnected')
+    parser.add_argument('--shed-lag', type=float, default=const.SHED_LAG,
+            help='Seconds of event loop lag past which broadcasts and '
+            'listings are refused')
+    parser.add_argument('--shed-buffered', type=int,
+            default=const.SHED_BUFFERED, help='Bytes queued for clients, '
+            'including those in transport buffers, past which broadcasts and '
+            'listings are refused')
     parser.add_argument('-q', '--quiet', action='store_true', default=False,
             help='Suppress logging output')
     args = parser.parse_args()
 
+    # Imported here as restart depends on this module
+    from . import restart
+
     loop = asyncio.get_event_loop()
-    server = Server.start(addr=args.addr, port=args.port, loop=loop)
+    socks, snapshot = (), args.snapshot
+    taken = None if args.handoff is None else restart.takeover(args.handoff)
+    if taken is not None:
+        socks, snapshot = taken
+    offline = None
+    if args.offline:
+        offline = OfflineStore(ttl=args.offline_ttl, spill=args.offline_spill,
+                max_bytes=args.offline_max_bytes,
+                max_spill_bytes=args.offline_max_spill_bytes, loop=loop)
+    server = Server.start(addr=args.addr, port=args.port, loop=loop,
+            unix=args.unix, socks=socks, offline=offline,
+            admins={} if args.admin_file is None else \
+                    read_admins(args.admin_file),
+            profile_dir=args.profile_dir, slow_callback=args.slow_callback,
+            capture=None if args.capture is None else \
+                    capture.Capture(args.capture),
+            max_connections=args.max_connections,
+            max_unidentified=args.max_unidentified,
+            identify_deadline=args.identify_deadline,
+            shed_lag=args.shed_lag, shed_buffered=args.shed_buffered)
+    def profile():
+        path = server.profiler.start(args.profile_seconds)
+        if path is not None and not args.quiet:
+            print('Profiling to {}'.format(path))
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, profile)
+    if snapshot is not None:
+        restart.restore(server, snapshot)
     if not args.quiet:
+        if taken is not None:
+            print('Took over from {}'.format(args.handoff))
         print('Serving on {}'.format(server.port))
+        for path in args.unix:
+            print('Serving on {}'.format(path))
+    handoff = None
+    if args.handoff is not None:
+        handoff = restart.Handoff(server, args.handoff,
+                snapshot=args.snapshot, drain_timeout=args.drain_timeout,
+                loop=loop)
+        handoff.listen()
+        handoff.done.add_done_callback(lambda future: loop.stop())
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         pass
 
-    server._sock.close()
-    loop.run_until_complete(server._sock.wait_closed())
+    if handoff is not None:
+        handoff.close()
+    # Once handed off the snapshot belongs to the new process
+    handed_off = handoff is not None and handoff.handed_off
+    if args.snapshot is not None and not handed_off:
+        restart.snapshot(server, args.snapshot)
+    server.close(unlink=not handed_off)
+    loop.run_until_complete(server.wait_closed())
+    server.shutdown()
     loop.close()
     if not args.quiet:
         print('Gracefully shutdown')
@@ -0,0 +1,54 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from asyncirc.server import Server
+from asyncirc.client import Client
+
+async def round_trips(client, count, payload):
+    start = time.perf_counter()
+    for i in range(0, count):
+        await client.echo(payload)
+    return (time.perf_counter() - start) / count
+
+def bench(name, connect, args, loop):
+    client = connect()
+    loop.run_until_complete(round_trips(client, args.warmup, args.payload))
+    latency = loop.run_until_complete(round_trips(client, args.count,
+        args.payload))
+    loop.run_until_complete(client.disconnect())
+    print('{:<10} {:>10.1f} us/msg'.format(name, latency * 1e6))
+
+def cli():
+    parser = argparse.ArgumentParser(
+            description='asyncirc per message echo latency by transport')
+    parser.add_argument('-n', '--count', type=int, default=10000,
+            help='Round trips to time per transport')
+    parser.add_argument('--warmup', type=int, default=1000,
+            help='Round trips to run before timing')
+    parser.add_argument('--size', type=int, default=64,
+            help='Payload size in bytes')
+    args = parser.parse_args()
+    args.payload = 'x' * args.size
+
+    loop = asyncio.new_event_loop()
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, 'asyncirc.sock')
+        server = Server.start(addr='127.0.0.1', port=0, loop=loop,
+                unix=[path, '@asyncirc-bench-%d' % (os.getpid())])
+        bench('tcp', lambda: Client.create_connection('127.0.0.1',
+            port=server.port, loop=loop), args, loop)
+        bench('unix', lambda: Client.create_connection(unix=path,
+            loop=loop), args, loop)
+        bench('abstract', lambda: Client.create_connection(
+            unix='@asyncirc-bench-%d' % (os.getpid()), loop=loop), args, loop)
+        bench('loopback', lambda: Client.create_loopback(server, loop=loop),
+                args, loop)
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,95 @@
+import gc
+import sys
+import argparse
+import tracemalloc
+
+from asyncirc import message
+from asyncirc.server import Server
+
+# Server side state only, kernel socket buffers and transports not included
+TARGET_CONNECTION = 512
+TARGET_MEMBERSHIP = 96
+
+class NullTransport(object):
+
+    __slots__ = ()
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def write(self, data):
+        pass
+
+    def write_message(self, msg):
+        pass
+
+    def close(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+def measure(f):
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = f()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, result
+
+def bench(count, rooms, joins):
+    server = Server()
+    transport = NullTransport()
+    names = [message.Identify('client%d' % (i)) for i in range(0, count)]
+    room_names = [message.JoinRoom('room%d' % (i)) for i in range(0, rooms)]
+    for msg in room_names:
+        server.create_room(msg.str_payload())
+
+    def connect():
+        clients = []
+        for msg in names:
+            client = server()
+            client.connection_made(transport)
+            server.handle_identify(client, msg)
+            clients.append(client)
+        return clients
+    tracemalloc.start()
+    connections, clients = measure(connect)
+    # The list holding the clients is benchmark overhead
+    connections -= sys.getsizeof(clients)
+
+    def join():
+        for i, client in enumerate(clients):
+            for j in range(0, joins):
+                server.handle_join_room(client,
+                        room_names[(i + j) % len(room_names)])
+    memberships, _ = measure(join)
+    tracemalloc.stop()
+    return connections / count, memberships / (count * joins)
+
+def cli():
+    parser = argparse.ArgumentParser(
+            description='asyncirc server memory per connection and membership')
+    parser.add_argument('-n', '--count', type=int, action='append',
+            help='Idle connections to create, may be repeated. Default is '
+            '10k, 100k and 1M')
+    parser.add_argument('--rooms', type=int, default=1000,
+            help='Rooms to spread the memberships over')
+    parser.add_argument('--joins', type=int, default=3,
+            help='Rooms each client joins')
+    args = parser.parse_args()
+
+    print('target: {} B/connection, {} B/membership'.format(
+        TARGET_CONNECTION, TARGET_MEMBERSHIP))
+    for count in args.count or [10000, 100000, 1000000]:
+        connection, membership = bench(count, args.rooms, args.joins)
+        met = connection <= TARGET_CONNECTION and \
+                membership <= TARGET_MEMBERSHIP
+        print('{:>8} clients {:>8.1f} B/connection {:>6.1f} B/membership {}'\
+                .format(count, connection, membership,
+                    'ok' if met else 'OVER TARGET'))
+
+if __name__ == '__main__':
+    cli()
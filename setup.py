@@ -30,7 +30,8 @@ setup(
     entry_points={
         'console_scripts': [
             'asyncircs = asyncirc.server:cli',
-            'asyncircc = asyncirc.client:cli'
+            'asyncircc = asyncirc.client:cli',
+            'asyncirc-replay = asyncirc.replay:cli'
         ]
     }
 )
@@ -0,0 +1,117 @@
+import asyncio
+import unittest
+
+import asyncirc
+from asyncirc import restart
+from asyncirc.auth import CredentialCache
+
+class TestAuth(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                loop=self.loop, kdf_iterations=1000)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            self.run_async(client.disconnect())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.server.shutdown()
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro,
+            10.0, loop=self.loop))
+
+    def connect(self):
+        client = asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop)
+        self.clients.append(client)
+        return client
+
+    def reconnect(self, client):
+        self.run_async(client.disconnect())
+        self.clients.remove(client)
+        return self.connect()
+
+    def test_0000_register(self):
+        client = self.connect()
+        self.assertIsNone(self.run_async(client.identify('test_client',
+            'secret')))
+        self.assertTrue(client.identified)
+        self.assertIn('test_client', self.server._credentials)
+        self.assertIs(self.server._clients['test_client'].identified, True)
+
+    def test_0010_protected(self):
+        client = self.connect()
+        self.run_async(client.identify('test_client', 'secret'))
+        client = self.reconnect(client)
+        self.assertEqual(self.run_async(client.identify('test_client')),
+                'password required for test_client')
+        self.assertFalse(client.identified)
+        self.assertEqual(self.run_async(client.identify('test_client',
+            'wrong')), 'wrong password for test_client')
+        self.assertFalse(client.identified)
+        self.assertIsNone(self.run_async(client.identify('test_client',
+            'secret')))
+        self.assertTrue(client.identified)
+
+    def test_0020_verified_cache(self):
+        client = self.connect()
+        self.run_async(client.identify('test_client', 'secret'))
+        client = self.reconnect(client)
+        self.run_async(client.identify('test_client', 'secret'))
+        self.assertEqual(self.server.metrics.counters['auth.cache_hits'], 1)
+        self.assertEqual(self.server.metrics.counters['auth.cache_misses'], 0)
+        self.server._verified.discard('test_client')
+        client = self.reconnect(client)
+        self.run_async(client.identify('test_client', 'secret'))
+        self.assertEqual(self.server.metrics.counters['auth.cache_misses'], 1)
+
+    def test_0030_protect_after_identify(self):
+        client = self.connect()
+        self.run_async(client.identify('test_client'))
+        client.send(asyncirc.message.IDProve('secret'))
+        self.run_async(client.echo('flush'))
+        self.assertIn('test_client', self.server._credentials)
+
+    def test_0040_busy(self):
+        self.server.max_kdf_pending = 0
+        client = self.connect()
+        self.assertEqual(self.run_async(client.identify('test_client',
+            'secret')), 'server busy')
+        self.assertEqual(self.server.metrics.counters['auth.busy'], 1)
+
+    def test_0050_snapshot(self):
+        client = self.connect()
+        self.run_async(client.identify('test_client', 'secret'))
+        server = asyncirc.server.Server()
+        restart.load(server, restart.dump(self.server))
+        self.assertEqual(server._credentials, self.server._credentials)
+
+class TestCredentialCache(unittest.TestCase):
+
+    def test_00_verified(self):
+        cache = CredentialCache()
+        cache.add('name', b'password', b'salt')
+        self.assertTrue(cache.verified('name', b'password', b'salt'))
+        self.assertFalse(cache.verified('name', b'wrong', b'salt'))
+        self.assertFalse(cache.verified('other', b'password', b'salt'))
+
+    def test_01_expiry(self):
+        cache = CredentialCache(ttl=-1.0)
+        cache.add('name', b'password', b'salt')
+        self.assertFalse(cache.verified('name', b'password', b'salt'))
+        self.assertEqual(len(cache), 0)
+
+    def test_02_size(self):
+        cache = CredentialCache(size=2)
+        for name in ['a', 'b', 'c']:
+            cache.add(name, b'password', b'salt')
+        self.assertFalse(cache.verified('a', b'password', b'salt'))
+        self.assertTrue(cache.verified('c', b'password', b'salt'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+
+import asyncirc
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server()
+        self.queries = 0
+        for name in ['list_rooms', 'room_members']:
+            self.server.handlers[name] = self.counted(
+                    self.server.handlers[name])
+        self.clients = []
+        self.client = self.connect('test_client')
+
+    def tearDown(self):
+        for client in self.clients:
+            self.run_async(client.disconnect())
+        self.server.shutdown()
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro,
+            10.0, loop=self.loop))
+
+    def counted(self, handler):
+        def wrapper(client, msg):
+            self.queries += 1
+            return handler(client, msg)
+        return wrapper
+
+    def connect(self, name):
+        client = asyncirc.client.Client.create_loopback(self.server,
+                loop=self.loop)
+        self.clients.append(client)
+        self.run_async(client.identify(name))
+        return client
+
+    def settle(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+
+    def test_0000_coalesced(self):
+        self.run_async(self.client.create_room('test_room'))
+        rooms = self.run_async(asyncio.gather(*[self.client.list_rooms()
+            for i in range(0, 3)], loop=self.loop))
+        self.assertEqual(rooms, ['test_room'] * 3)
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(self.client._inflight, {})
+        # Not cached unless enabled
+        self.run_async(self.client.list_rooms())
+        self.assertEqual(self.queries, 2)
+
+    def test_0010_cached(self):
+        self.run_async(self.client.enable_cache())
+        self.assertEqual(self.client.generation, self.server.generation)
+        self.run_async(self.client.create_room('test_room'))
+        for i in range(0, 3):
+            self.assertEqual(self.run_async(self.client.list_rooms()),
+                    'test_room')
+        self.assertEqual(self.run_async(self.client.list_rooms_page(10)),
+                (['test_room'], ''))
+        self.assertEqual(self.queries, 2)
+
+    def test_0020_invalidated(self):
+        self.run_async(self.client.enable_cache())
+        self.run_async(self.client.join_room('test_room'))
+        self.assertEqual(self.run_async(self.client.room_members(
+            'test_room')), 'test_client')
+        other = self.connect('other_client')
+        self.run_async(other.join_room('test_room'))
+        self.settle()
+        self.assertEqual(self.run_async(self.client.room_members(
+            'test_room')), 'test_client\nother_client')
+        self.assertEqual(self.queries, 2)
+        # Changes the client makes itself are seen without waiting
+        self.run_async(self.client.leave_room('test_room'))
+        self.assertEqual(self.run_async(self.client.room_members(
+            'test_room')), 'other_client')
+        self.assertEqual(self.queries, 3)
+
+    def test_0030_ttl(self):
+        self.run_async(self.client.enable_cache(ttl=0.0))
+        self.run_async(self.client.list_rooms())
+        self.run_async(self.client.list_rooms())
+        self.assertEqual(self.queries, 2)
+
+    def test_0040_push_coalesced(self):
+        generations = self.client.messages(filter='generation')
+        self.run_async(self.client.enable_cache())
+        self.run_async(generations.__anext__())
+        self.loop.call_soon(lambda: [self.server.create_room('room%d' % (i))
+            for i in range(0, 3)])
+        self.settle()
+        msg = self.run_async(generations.__anext__())
+        self.assertEqual(int(msg.str_payload()), self.server.generation)
+        self.assertEqual(len(generations._queue), 0)
+        self.assertEqual(self.client.generation, self.server.generation)
+
+    def test_0050_concurrent_queries(self):
+        self.run_async(self.client.enable_cache())
+        for name, room_name in [('a', 'ra'), ('b', 'rb')]:
+            self.run_async(self.connect(name).join_room(room_name))
+        self.settle()
+        results = self.run_async(asyncio.gather(
+            self.client.room_members('ra'), self.client.room_members('rb'),
+            self.client.list_rooms(), self.client.room_members_page('rb'),
+            loop=self.loop))
+        self.assertEqual(results, ['a', 'b', 'ra\nrb', (['b'], '')])
+        self.assertEqual(self.run_async(self.client.room_members('rb')), 'b')
+        self.assertEqual(self.queries, 4)
+
+    def test_0060_abandoned(self):
+        # A reply slower than every caller is patient for
+        handler = self.server.handlers['room_members']
+        def slow(client, msg):
+            self.loop.call_later(0.05, handler, client, msg)
+        self.server.handlers['room_members'] = slow
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(asyncio.wait_for(
+                self.client.room_members('x'), 0.01, loop=self.loop))
+        self.assertEqual(self.client._inflight, {})
+        self.server.handlers['room_members'] = handler
+        self.run_async(self.client.join_room('x'))
+        self.assertEqual(self.run_async(self.client.room_members('x')),
+                'test_client')
+        self.assertEqual(self.client._inflight, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from asyncirc.index import SortedIndex
+
+class TestSortedIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SortedIndex()
+        for name in ['dog', 'cat', 'cow', 'ant', 'crow', 'cat']:
+            self.index.add(name)
+
+    def test_00_sorted(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.page(10), (['ant', 'cat', 'cow', 'crow',
+            'dog'], ''))
+
+    def test_01_prefix(self):
+        self.assertEqual(self.index.page(10, prefix='c'),
+                (['cat', 'cow', 'crow'], ''))
+        self.assertEqual(self.index.page(10, prefix='e'), ([], ''))
+
+    def test_02_cursor(self):
+        self.assertEqual(self.index.page(2, prefix='c'), (['cat', 'cow'],
+            'cow'))
+        self.assertEqual(self.index.page(2, 'cow', 'c'), (['crow'], ''))
+
+    def test_03_discard(self):
+        self.index.discard('cow')
+        self.index.discard('missing')
+        self.assertNotIn('cow', self.index)
+        self.assertIn('crow', self.index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,9 +10,7 @@ class TestIRC(unittest.TestCase):
         self.loop = asyncio.new_event_loop()
         self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
                 loop=self.loop)
-        self.client = asyncirc.client.Client\
-                .create_connection('127.0.0.1', port=self.server.port,
-                        loop=self.loop)
+        self.client = self.connect()
 
     def tearDown(self):
         self.run_async(self.client.disconnect())
@@ -21,6 +19,10 @@ class TestIRC(unittest.TestCase):
         self.loop.run_until_complete(self.server._sock.wait_closed())
         self.loop.close()
 
+    def connect(self):
+        return asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop)
+
     def run_async(self, coro):
         return self.loop.run_until_complete(asyncio.wait_for(coro,
             1.0, loop=self.loop))
@@ -49,12 +51,35 @@ class TestIRC(unittest.TestCase):
         room_list = self.run_async(self.client.list_rooms())
         self.assertEqual(room_list, '\n'.join(rooms))
 
+    def test_0051_list_rooms_page(self):
+        rooms = ['Room %d' % (i) for i in range(0, 10)]
+        self.run_async(self.client.identify('test_client'))
+        for room_name in rooms:
+            self.run_async(self.client.create_room(room_name))
+        page, cursor = self.run_async(self.client.list_rooms_page(4))
+        self.assertEqual(page, rooms[:4])
+        self.assertEqual(cursor, 'Room 3')
+        page, cursor = self.run_async(self.client.list_rooms_page(8, cursor))
+        self.assertEqual(page, rooms[4:])
+        self.assertEqual(cursor, '')
+
+    def test_0052_iter_rooms_prefix(self):
+        rooms = ['a%d' % (i) for i in range(0, 5)] + \
+                ['b%d' % (i) for i in range(0, 5)]
+        self.run_async(self.client.identify('test_client'))
+        for room_name in reversed(rooms):
+            self.run_async(self.client.create_room(room_name))
+        async def collect():
+            return [room async for room in self.client.iter_rooms(prefix='b',
+                page_size=2)]
+        self.assertEqual(self.run_async(collect()), rooms[5:])
+
     def test_0060_join_room(self):
         self.run_async(self.client.identify('test_client'))
         self.run_async(self.client.create_room('test_room'))
         self.run_async(self.client.join_room('test_room'))
         self.run_async(self.client.disconnect())
-        self.assertIn('test_client', self.server._rooms['test_room']._clients)
+        self.assertIn('test_client', self.server._rooms['test_room'].clients())
 
     def test_0070_leave_room(self):
         self.run_async(self.client.identify('test_client'))
@@ -69,8 +94,7 @@ class TestIRC(unittest.TestCase):
         self.run_async(self.client.create_room('test_room'))
         self.run_async(self.client.join_room('test_room'))
         for client_name in members:
-            client = asyncirc.client.Client.create_connection(
-                    '127.0.0.1', port=self.server.port, loop=self.loop)
+            client = self.connect()
             self.run_async(client.identify(client_name))
             self.run_async(client.join_room('test_room'))
             clients.append(client)
@@ -79,11 +103,70 @@ class TestIRC(unittest.TestCase):
             self.run_async(client.disconnect())
         self.assertEqual(member_list , '\n'.join(['test_client'] + members))
 
+    def test_0081_iter_room_members(self):
+        members = ['client%d' % (i) for i in range(0, 10)]
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        for client_name in reversed(members):
+            client = self.connect()
+            self.run_async(client.identify(client_name))
+            self.run_async(client.join_room('test_room'))
+        async def collect():
+            return [member async for member in
+                self.client.iter_room_members('test_room', prefix='client',
+                    page_size=3)]
+        self.assertEqual(self.run_async(collect()), members)
+
+    def test_0082_reconnect_rejoin(self):
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        self.run_async(self.client.disconnect())
+        self.client = self.connect()
+        messages = self.client.messages(filter='broadcast')
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        self.assertEqual(self.run_async(self.client.room_members(
+            'test_room')), 'test_client')
+        # Broadcasts reach the new connection, not the old one
+        client = self.connect()
+        self.run_async(client.identify('other_client'))
+        self.run_async(client.msg_room('test_room', 'Hello'))
+        self.assertEqual(self.run_async(messages.__anext__()).str_payload(),
+                'Hello')
+        self.run_async(self.client.leave_room('test_room'))
+        room = self.server._rooms['test_room']
+        self.assertEqual(room.clients(), [])
+        self.assertEqual(room.page(10), ([], ''))
+        self.run_async(client.disconnect())
+
+    def test_0083_iter_room_members_no_room(self):
+        self.run_async(self.client.identify('test_client'))
+        self.assertEqual(self.run_async(self.client.room_members_page(
+            'no_room')), ([], ''))
+        async def collect():
+            return [member async for member in
+                self.client.iter_room_members('no_room')]
+        self.assertEqual(self.run_async(collect()), [])
+
+    def test_0084_room_members_join_order(self):
+        members = ['client%d' % (i) for i in range(0, 5)]
+        clients = []
+        for client_name in members:
+            client = self.connect()
+            self.run_async(client.identify(client_name))
+            clients.append(client)
+        for client in reversed(clients):
+            self.run_async(client.join_room('test_room'))
+        self.run_async(self.client.identify('test_client'))
+        member_list = self.run_async(self.client.room_members('test_room'))
+        for client in clients:
+            self.run_async(client.disconnect())
+        self.assertEqual(member_list, '\n'.join(reversed(members)))
+
     def test_0090_multiple_clients(self):
         clients = []
         for i in range(0, 10):
-            client = asyncirc.client.Client.create_connection(
-                    '127.0.0.1', port=self.server.port, loop=self.loop)
+            client = self.connect()
             self.run_async(client.identify('client%d' % (i)))
             clients.append(client)
         for client in clients:
@@ -151,8 +234,7 @@ class TestIRC(unittest.TestCase):
             self.run_async(self.client.echo('echo!'))
 
     def test_0150_server_handles_client_crash(self):
-        client = asyncirc.client.Client.create_connection(
-                '127.0.0.1', port=self.server.port, loop=self.loop)
+        client = self.connect()
         self.run_async(client.identify('crash_client'))
         self.run_async(client.create_room('room'))
         self.run_async(client.join_room('room'))
@@ -184,5 +266,91 @@ class TestIRC(unittest.TestCase):
         res = self.run_async(self.client.msg_client('no_existo', 'H'))
         self.assertEqual(res, 'no such client no_existo')
 
+    def test_0190_message_stream(self):
+        messages = self.client.messages()
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        self.run_async(self.client.msg_room('test_room', 'Hello Room!'))
+        self.run_async(self.client.msg_client('test_client', 'Hello Me!'))
+        msg = self.run_async(messages.__anext__())
+        self.assertEqual(msg.handler, 'broadcast')
+        self.assertEqual(msg.str_payload(), 'Hello Room!')
+        msg = self.run_async(messages.__anext__())
+        self.assertEqual(msg.handler, 'client_msg')
+        self.assertEqual(msg.str_payload(), 'Hello Me!')
+
+    def test_0191_message_stream_backpressure(self):
+        messages = self.client.messages(filter='client_msg', maxsize=1)
+        self.run_async(self.client.identify('test_client'))
+        client = self.connect()
+        self.run_async(client.identify('sender'))
+        for i in range(0, 3):
+            self.run_async(client.msg_client('test_client', str(i)))
+        self.run_async(client.disconnect())
+        self.run_async(asyncio.sleep(0.05, loop=self.loop))
+        self.assertTrue(self.client._reading_paused)
+        async def collect():
+            return [msg.str_payload() for msg in [await messages.__anext__()
+                for i in range(0, 3)]]
+        self.assertEqual(self.run_async(collect()), ['0', '1', '2'])
+        self.assertFalse(self.client._reading_paused)
+        messages.close()
+        with self.assertRaises(StopAsyncIteration):
+            self.run_async(messages.__anext__())
+
+    def test_0192_message_stream_large_frames(self):
+        messages = self.client.messages(filter='broadcast', maxsize=4)
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        client = self.connect()
+        self.run_async(client.identify('sender'))
+        client.add_handler('handle_room_msgd', lambda client, msg: None)
+        payload = 'x' * (5 * 1024)
+        for i in range(0, 300):
+            client.send(asyncirc.message.MsgRoom('test_room', payload))
+        async def collect():
+            received = []
+            for i in range(0, 300):
+                msg = await messages.__anext__()
+                if not i % 50:
+                    await asyncio.sleep(0.01, loop=self.loop)
+                received.append(msg.str_payload())
+            return received
+        received = self.loop.run_until_complete(asyncio.wait_for(collect(),
+            10.0, loop=self.loop))
+        self.assertEqual(received, [payload] * 300)
+        self.assertTrue(self.client.connected())
+        self.run_async(client.disconnect())
+
+    def test_0193_message_stream_requests(self):
+        messages = self.client.messages(filter='broadcast', maxsize=2)
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        client = self.connect()
+        self.run_async(client.identify('sender'))
+        for i in range(0, 5):
+            self.run_async(client.msg_room('test_room', str(i)))
+        self.run_async(asyncio.sleep(0.05, loop=self.loop))
+        self.assertTrue(self.client._reading_paused)
+        async def bot():
+            received = []
+            async for msg in messages:
+                # Replies are read while the subscription is full
+                await self.client.echo(msg.str_payload())
+                received.append(msg.str_payload())
+                if len(received) == 5:
+                    return received
+        self.assertEqual(self.run_async(bot()), ['0', '1', '2', '3', '4'])
+        self.assertFalse(self.client._reading_paused)
+        self.run_async(client.disconnect())
+
+    def test_0194_oversized_frame(self):
+        self.run_async(self.client.identify('test_client'))
+        # Disconnected rather than buffered until the claimed length arrives
+        self.client.transport.write(asyncirc.message.Message.INITIAL.pack(
+            4, 0, 2 ** 40) + b'echo' + b'x' * 1024)
+        self.run_async(self.client.disconnected)
+        self.assertNotIn('test_client', self.server._clients)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+import asyncirc
+from asyncirc.loopback import LoopbackTransport
+
+from tests import test_irc
+
+class TestIRCLoopback(test_irc.TestIRC):
+
+    def connect(self):
+        return asyncirc.client.Client.create_loopback(self.server,
+                loop=self.loop)
+
+    def test_0200_thousands_of_clients(self):
+        clients = [self.connect() for i in range(0, 2000)]
+        self.loop.run_until_complete(asyncio.gather(*[
+            client.identify('client%d' % (i)) for i, client in
+            enumerate(clients)], loop=self.loop))
+        self.loop.run_until_complete(asyncio.gather(*[
+            client.join_room('test_room') for client in clients],
+            loop=self.loop))
+        self.assertEqual(len(self.server._rooms['test_room'].clients()),
+                len(clients))
+        self.loop.run_until_complete(asyncio.gather(*[
+            client.disconnect() for client in clients], loop=self.loop))
+
+    def test_0210_frames_not_serialized(self):
+        received = []
+        self.client.add_handler('handle_echo', lambda client, msg:
+            received.append(msg))
+        msg = asyncirc.message.Echo('Hello World!')
+        self.client.send(msg)
+        self.run_async(self.client.echo('flush'))
+        self.assertIs(received[0], msg)
+
+class Protocol(asyncio.Protocol):
+
+    def __init__(self):
+        self.events = []
+
+    def pause_writing(self):
+        self.events.append('pause_writing')
+
+    def resume_writing(self):
+        self.events.append('resume_writing')
+
+    def data_received(self, data):
+        self.events.append(data)
+
+    def connection_lost(self, exc):
+        self.events.append('connection_lost')
+
+class TestLoopbackTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.protocol = Protocol()
+        self.transport, self.peer = asyncirc.loopback.connect(self.protocol,
+                Protocol, self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+
+    def test_00_write(self):
+        self.transport.write(b'Hello')
+        self.run_once()
+        self.assertEqual(self.peer.events, [b'Hello'])
+
+    def test_01_flow_control(self):
+        self.transport.set_write_buffer_limits(high=4)
+        self.peer_transport().pause_reading()
+        self.transport.write(b'Hello')
+        self.assertEqual(self.transport.get_write_buffer_size(), 5)
+        self.assertEqual(self.protocol.events, ['pause_writing'])
+        self.run_once()
+        self.assertEqual(self.peer.events, [])
+        self.peer_transport().resume_reading()
+        self.run_once()
+        self.assertEqual(self.peer.events, [b'Hello'])
+        self.assertEqual(self.protocol.events, ['pause_writing',
+            'resume_writing'])
+
+    def test_02_close(self):
+        self.transport.write(b'Bye')
+        self.transport.close()
+        self.transport.write(b'Ignored')
+        self.run_once()
+        self.assertEqual(self.peer.events, [b'Bye', 'connection_lost'])
+        self.assertEqual(self.protocol.events, ['connection_lost'])
+
+    def peer_transport(self) -> LoopbackTransport:
+        return self.transport._peer
+
+if __name__ == '__main__':
+    unittest.main()
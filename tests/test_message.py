@@ -1,7 +1,8 @@
 import struct
 import unittest
 
-from asyncirc.message import Message
+from asyncirc.message import Message, Echo
+from asyncirc.server import Server
 
 class TestMessage(unittest.TestCase):
 
@@ -29,5 +30,20 @@ class TestMessage(unittest.TestCase):
         self.assertEqual(msg.header, self.header)
         self.assertEqual(msg.payload, self.payload)
 
+    def test_02_complete(self):
+        msg = bytes(Message(self.handler, self.header, self.payload))
+        self.assertEqual(Message.complete(msg + msg[:-1]), len(msg))
+        self.assertEqual(Message.complete(msg[:10]), 0)
+        with self.assertRaises(ValueError):
+            Message.complete(msg, max_size=len(msg) - 1)
+        with self.assertRaises(ValueError):
+            Message.complete(Message.INITIAL.pack(4, 0, 2 ** 40))
+
+    def test_03_no_instance_dict(self):
+        # Per connection and per message state lives in slots only
+        for obj in [Message(self.handler, self.header, self.payload),
+                Echo('Hello'), Server()()]:
+            self.assertFalse(hasattr(obj, '__dict__'), obj)
+
 if __name__ == '__main__':
     unittest.main()
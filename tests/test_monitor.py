@@ -0,0 +1,128 @@
+import os
+import time
+import pstats
+import asyncio
+import unittest
+import tempfile
+
+import asyncirc
+from asyncirc.metrics import Metrics
+from asyncirc.message import Message
+from asyncirc.monitor import LagMonitor, Profiler
+
+def stall(client, msg):
+    time.sleep(0.02)
+
+class TestLagMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_0000_lag(self):
+        metrics = Metrics()
+        monitor = LagMonitor(metrics, interval=0.01, loop=self.loop)
+        monitor.start()
+        self.loop.call_soon(time.sleep, 0.05)
+        self.loop.run_until_complete(asyncio.sleep(0.1, loop=self.loop))
+        monitor.stop()
+        self.assertGreater(metrics.timings['loop.lag'].count, 1)
+        self.assertGreaterEqual(metrics.timings['loop.lag'].max, 0.03)
+
+    def test_0010_profiler(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = Profiler(directory, loop=self.loop)
+            path = profiler.start(60.0)
+            self.assertTrue(path.startswith(directory))
+            self.assertIsNone(profiler.start(60.0))
+            sum(range(0, 1000))
+            self.loop.run_until_complete(profiler.stop())
+            self.assertIsNone(profiler.stop())
+            self.assertTrue(pstats.Stats(path).total_calls)
+
+class TestMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                loop=self.loop, handlers={'stall': stall},
+                slow_callback=0.01, admins={'admin': b'secret'}, kdf_iterations=1000,
+                profile_dir=self.directory.name)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            self.run_async(client.disconnect())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.server.shutdown()
+        self.loop.close()
+        self.directory.cleanup()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro,
+            10.0, loop=self.loop))
+
+    def connect(self, name, password=None):
+        client = asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop)
+        self.clients.append(client)
+        self.run_async(client.identify(name, password))
+        return client
+
+    def test_0000_started(self):
+        self.loop.run_until_complete(asyncio.sleep(
+            asyncirc.const.LAG_INTERVAL * 2, loop=self.loop))
+        self.assertIn('loop.lag', self.server.metrics.gauges)
+
+    def test_0010_slow_handler(self):
+        client = self.connect('test_client')
+        client.send(Message('stall', b'', b''))
+        self.assertEqual(self.run_async(client.echo('fast')), 'fast')
+        self.assertEqual(self.server.metrics.counters['slow.handler.stall'],
+                1)
+        self.assertGreaterEqual(
+                self.server.metrics.counters['slow.data_received'], 1)
+        self.assertNotIn('slow.handler.echo', self.server.metrics.counters)
+
+    def test_0020_profile(self):
+        client = self.connect('admin', 'secret')
+        path = self.run_async(client.profile(60))
+        self.assertEqual(os.path.dirname(path), self.directory.name)
+        self.assertEqual(self.run_async(client.profile(60)), 'server busy')
+        self.run_async(self.server.profiler.stop())
+        self.assertTrue(os.path.exists(path))
+
+    def test_0030_not_admin(self):
+        client = self.connect('test_client')
+        self.assertEqual(self.run_async(client.profile()), 'not an admin')
+        # Admin names are protected by the operator's password from the start
+        client = asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop)
+        self.clients.append(client)
+        self.assertEqual(self.run_async(client.identify('admin')),
+                'password required for admin')
+        self.assertEqual(self.run_async(client.identify('admin', 'guess')),
+                'wrong password for admin')
+        self.assertIsNone(self.server.profiler.path)
+
+    def test_0031_bad_seconds(self):
+        client = self.connect('admin', 'secret')
+        for seconds in ['soon', 'nan', 'inf', -1]:
+            self.assertEqual(self.run_async(client.profile(seconds)),
+                    'invalid seconds')
+        self.assertTrue(client.connected())
+        self.assertIsNone(self.server.profiler.path)
+
+    def test_0032_read_admins(self):
+        path = os.path.join(self.directory.name, 'admins')
+        with open(path, 'w') as fd:
+            fd.write('admin:se:cret\n\nops:pass\n')
+        self.assertEqual(asyncirc.server.read_admins(path),
+                {'admin': b'se:cret', 'ops': b'pass'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+import os
+import time
+import asyncio
+import unittest
+import tempfile
+
+import asyncirc
+from asyncirc import offline
+from asyncirc.offline import OfflineStore
+
+class TestOfflineStore(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def payloads(self, msgs):
+        return [(msg.str_header(), msg.str_payload()) for msg in msgs]
+
+    def spilled(self, store, recipient):
+        return self.payloads(msg for expires, msg in
+                self.loop.run_until_complete(store.take_spilled(recipient)))
+
+    def test_00_take(self):
+        store = OfflineStore(loop=self.loop)
+        store.put('bob', 'alice', b'one')
+        store.put('bob', 'carol', b'two')
+        store.put('dave', 'alice', b'other')
+        self.assertEqual(self.payloads(store.take('bob')), [('alice', 'one'),
+            ('carol', 'two')])
+        self.assertEqual(store.take('bob'), [])
+        self.assertIsNone(store.take_spilled('bob'))
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.size, len(b'other') + offline.ENTRY_OVERHEAD +
+                offline.RECIPIENT_OVERHEAD)
+        store.close()
+
+    def test_01_expire(self):
+        store = OfflineStore(loop=self.loop)
+        store.put('bob', 'alice', b'short', ttl=1.0)
+        store.put('bob', 'alice', b'long', ttl=60.0)
+        store.expire(time.time() + 2.0)
+        self.assertEqual(store.expired, 1)
+        self.assertEqual(self.payloads(store.take('bob')), [('alice',
+            'long')])
+        store.close()
+
+    def test_02_timer(self):
+        store = OfflineStore(loop=self.loop)
+        store.put('bob', 'alice', b'gone', ttl=0.01)
+        self.loop.run_until_complete(asyncio.sleep(0.05, loop=self.loop))
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.size, 0)
+        self.assertIsNone(store._timer)
+
+    def test_03_bounded(self):
+        store = OfflineStore(max_messages=2, max_bytes=3 *
+                offline.ENTRY_OVERHEAD + offline.RECIPIENT_OVERHEAD + 8,
+                loop=self.loop)
+        for payload in [b'1', b'2', b'3']:
+            store.put('bob', 'alice', payload)
+        self.assertFalse(store.put('carol', 'alice', b'too large'))
+        self.assertEqual(store.dropped, 2)
+        self.assertEqual(self.payloads(store.take('bob')), [('alice', '2'),
+            ('alice', '3')])
+        self.assertEqual(store.size, 0)
+        store.close()
+
+    def test_04_spill(self):
+        with tempfile.TemporaryDirectory() as spill:
+            store = OfflineStore(max_bytes=offline.ENTRY_OVERHEAD +
+                    offline.RECIPIENT_OVERHEAD + 4, spill=spill,
+                    loop=self.loop)
+            for payload in [b'1234', b'5678', b'9']:
+                self.assertTrue(store.put('bob', 'alice', payload))
+            self.assertEqual(store.spill_size, 5)
+            self.assertEqual(self.payloads(store.take('bob')), [
+                ('alice', '1234')])
+            self.assertEqual(self.spilled(store, 'bob'), [('alice', '5678'),
+                ('alice', '9')])
+            self.assertEqual(store.spill_size, 0)
+            self.assertIsNone(store.take_spilled('bob'))
+            self.assertEqual(os.listdir(spill), [])
+            store.close()
+
+    def test_05_compact(self):
+        store = OfflineStore(loop=self.loop)
+        for i in range(0, 200):
+            store.put('client%d' % (i), 'alice', b'hi')
+            store.take('client%d' % (i))
+        self.assertLess(len(store._heap), 200)
+        store.close()
+
+    def test_06_overhead(self):
+        # Empty messages to many recipients still take memory
+        store = OfflineStore(max_bytes=1024 * 1024, loop=self.loop)
+        stored = sum(1 for i in range(0, 10000) if
+                store.put('r%d' % (i), 'x', b''))
+        self.assertLess(stored, 1024 * 1024 // offline.RECIPIENT_OVERHEAD)
+        self.assertLessEqual(store.size, store.max_bytes)
+        store.close()
+
+    def test_07_max_recipients(self):
+        store = OfflineStore(max_recipients=2, loop=self.loop)
+        self.assertTrue(store.put('bob', 'alice', b'1'))
+        self.assertTrue(store.put('carol', 'alice', b'1'))
+        self.assertFalse(store.put('dave', 'alice', b'1'))
+        self.assertTrue(store.put('bob', 'alice', b'2'))
+        store.close()
+
+    def test_08_spill_bounded(self):
+        with tempfile.TemporaryDirectory() as spill:
+            store = OfflineStore(max_bytes=0, max_messages=2, spill=spill,
+                    max_spill_bytes=10, loop=self.loop)
+            for payload in [b'1', b'2', b'3']:
+                store.put('bob', 'alice', payload)
+            self.assertFalse(store.put('carol', 'alice', b'far too large'))
+            self.assertEqual(store.dropped, 2)
+            self.assertEqual(self.spilled(store, 'bob'), [('alice', '1'),
+                ('alice', '2')])
+            store.close()
+
+    def test_09_spill_expired(self):
+        with tempfile.TemporaryDirectory() as spill:
+            store = OfflineStore(max_bytes=0, spill=spill, loop=self.loop)
+            store.put('bob', 'alice', b'short', ttl=0.01)
+            store.put('bob', 'alice', b'long', ttl=0.05)
+            self.loop.run_until_complete(asyncio.sleep(0.03, loop=self.loop))
+            self.assertIn('bob', store._spilled)
+            self.loop.run_until_complete(asyncio.sleep(0.05, loop=self.loop))
+            self.assertNotIn('bob', store._spilled)
+            store.close()
+            self.assertEqual(os.listdir(spill), [])
+            self.assertEqual(store.expired, 2)
+            self.assertEqual(store.spill_size, 0)
+
+    def test_10_ttl(self):
+        store = OfflineStore(ttl=60.0, loop=self.loop)
+        for ttl in [0, -1.0, float('nan'), float('inf'), float('-inf')]:
+            self.assertFalse(store.put('bob', 'alice', b'1', ttl=ttl))
+        self.assertTrue(store.put('bob', 'alice', b'1', ttl=1e12))
+        self.assertLessEqual(store._heap[0][0], time.time() + 60.0)
+        store.close()
+
+    def test_11_expires_kept(self):
+        store = OfflineStore(ttl=60.0, loop=self.loop)
+        self.assertFalse(store.put('bob', 'alice', b'1',
+            expires=time.time() - 1.0))
+        expires = time.time() + 1.0
+        self.assertTrue(store.put('bob', 'alice', b'1', expires=expires))
+        self.assertEqual(store._heap[0][0], expires)
+        store.close()
+
+    def test_12_index(self):
+        with tempfile.TemporaryDirectory() as spill:
+            store = OfflineStore(max_bytes=0, spill=spill, loop=self.loop)
+            store.put('bob', 'alice', b'kept')
+            store.put('carol', 'alice', b'gone', ttl=0.01)
+            store.close()
+            self.assertEqual(os.stat(store.spill_path('bob')).st_mode & 0o777,
+                    0o600)
+            with open(store.spill_path('bob'), 'ab') as fd:
+                fd.write(b'partial')
+            self.loop.run_until_complete(asyncio.sleep(0.02, loop=self.loop))
+            # Files of a previous run are held again until they expire
+            store = OfflineStore(max_bytes=0, spill=spill, loop=self.loop)
+            self.assertEqual(list(store._spilled), ['bob'])
+            self.assertEqual(store.spill_size, 4)
+            self.assertEqual(os.listdir(spill), [os.path.basename(
+                store.spill_path('bob'))])
+            self.assertEqual(self.spilled(store, 'bob'), [('alice', 'kept')])
+            store.close()
+
+class TestOffline(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server(
+                offline=OfflineStore(loop=self.loop))
+        self.client = self.connect()
+        self.loop.run_until_complete(self.client.identify('test_client'))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.disconnect())
+        self.server.shutdown()
+        self.loop.close()
+
+    def connect(self):
+        return asyncirc.client.Client.create_loopback(self.server,
+                loop=self.loop)
+
+    def test_00_delivered_on_identify(self):
+        for payload in ['Hello', 'World']:
+            self.assertIsNone(self.loop.run_until_complete(
+                self.client.msg_client('offline_client', payload)))
+        self.assertEqual(self.server.metrics.counters['offline.stored'], 2)
+        client = self.connect()
+        messages = client.messages(filter='client_msg')
+        self.loop.run_until_complete(client.identify('offline_client'))
+        received = [self.loop.run_until_complete(messages.__anext__())
+                for i in range(0, 2)]
+        self.assertEqual([(msg.str_header(), msg.str_payload()) for msg in
+            received], [('test_client', 'Hello'), ('test_client', 'World')])
+        self.loop.run_until_complete(client.disconnect())
+
+    def test_01_ephemeral(self):
+        res = self.loop.run_until_complete(self.client.msg_client(
+            'offline_client', 'Now or never', ttl=0))
+        self.assertEqual(res, 'no such client offline_client')
+        self.assertEqual(len(self.server.offline), 0)
+
+    def test_02_invalid_ttl(self):
+        for ttl in ['nan', 'inf', 'soon']:
+            res = self.loop.run_until_complete(self.client.msg_client(
+                'offline_client', 'Hello', ttl=ttl))
+            self.assertEqual(res, 'no such client offline_client')
+        self.assertEqual(len(self.server.offline), 0)
+
+    def test_03_spilled_on_identify(self):
+        with tempfile.TemporaryDirectory() as spill:
+            self.server.offline.spill = spill
+            self.server.offline.max_bytes = 0
+            for payload in ['Hello', 'World']:
+                self.loop.run_until_complete(self.client.msg_client(
+                    'offline_client', payload))
+            self.assertEqual(len(self.server.offline._spilled), 1)
+            client = self.connect()
+            messages = client.messages(filter='client_msg')
+            self.loop.run_until_complete(client.identify('offline_client'))
+            received = [self.loop.run_until_complete(asyncio.wait_for(
+                messages.__anext__(), 1.0, loop=self.loop))
+                for i in range(0, 2)]
+            self.assertEqual([msg.str_payload() for msg in received],
+                    ['Hello', 'World'])
+            self.loop.run_until_complete(client.disconnect())
+
+    def test_04_spilled_before_sent(self):
+        class SlowStore(OfflineStore):
+            def read_spilled(self, recipient):
+                time.sleep(0.05)
+                return super().read_spilled(recipient)
+        with tempfile.TemporaryDirectory() as spill:
+            self.server.offline = SlowStore(max_bytes=0, spill=spill,
+                    loop=self.loop)
+            self.loop.run_until_complete(self.client.msg_client(
+                'offline_client', 'Held'))
+            client = self.connect()
+            messages = client.messages(filter='client_msg')
+            self.loop.run_until_complete(client.identify('offline_client'))
+            # Sent while the held message is still being read
+            self.loop.run_until_complete(self.client.msg_client(
+                'offline_client', 'Sent'))
+            received = [self.loop.run_until_complete(asyncio.wait_for(
+                messages.__anext__(), 1.0, loop=self.loop))
+                for i in range(0, 2)]
+            self.assertEqual([msg.str_payload() for msg in received],
+                    ['Held', 'Sent'])
+            self.loop.run_until_complete(client.disconnect())
+
+if __name__ == '__main__':
+    unittest.main()
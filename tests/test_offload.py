@@ -0,0 +1,103 @@
+import time
+import asyncio
+import unittest
+import threading
+
+import asyncirc
+from asyncirc.server import Handler
+from asyncirc.message import Echo, Message
+
+class Upper(Handler):
+
+    mode = Handler.PROCESS
+
+    def work(self, msg):
+        return Echo(msg.str_payload().upper())
+
+class Slow(Handler):
+
+    mode = Handler.THREAD
+
+    def __init__(self, server):
+        super().__init__(server)
+        self.release = threading.Event()
+
+    def work(self, msg):
+        self.release.wait(1.0)
+        return Echo('slow')
+
+class Reverse(Handler):
+
+    async def __call__(self, client, msg):
+        await asyncio.sleep(0)
+        client.send(Echo(msg.str_payload()[::-1]))
+
+class TestOffload(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                loop=self.loop, handlers={'upper': Upper(None),
+                    'slow': Slow(None), 'reverse': Reverse(None)},
+                max_pending=4)
+        self.client = asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop)
+        self.echoed = []
+        self.all_echoed = None
+        self.client.add_handler('handle_echo', self.handle_echo)
+
+    def tearDown(self):
+        self.server.handlers['slow'].release.set()
+        self.run_async(self.client.disconnect())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.server.shutdown()
+        self.loop.close()
+
+    def run_async(self, coro, timeout=1.0):
+        return self.loop.run_until_complete(asyncio.wait_for(coro,
+            timeout, loop=self.loop))
+
+    def handle_echo(self, client, msg):
+        self.echoed.append(msg.str_payload())
+        if len(self.echoed) == self.expected:
+            self.all_echoed.set_result(True)
+
+    def expect(self, count, timeout=1.0):
+        self.expected = count
+        self.all_echoed = asyncio.Future(loop=self.loop)
+        self.run_async(self.all_echoed, timeout)
+
+    def test_0000_modes(self):
+        self.assertEqual(self.server.modes, {'upper': Handler.PROCESS,
+            'slow': Handler.THREAD, 'reverse': Handler.COROUTINE,
+            'id_prove': Handler.COROUTINE})
+
+    def test_0010_ordering(self):
+        self.client.send(Message('slow', b'', b''), Echo('fast'),
+                Message('reverse', b'', b'olleh'))
+        self.loop.call_later(0.05, self.server.handlers['slow'].release.set)
+        self.expect(3)
+        self.assertEqual(self.echoed, ['slow', 'fast', 'hello'])
+        self.assertEqual(self.server.metrics.gauges['executor.thread.pending'],
+                0)
+        self.assertEqual(
+                self.server.metrics.counters['executor.thread.submitted'], 1)
+
+    def test_0020_process(self):
+        self.client.send(Message('upper', b'', b'hello'), Echo('done'))
+        self.expect(2, timeout=10.0)
+        self.assertEqual(self.echoed, ['HELLO', 'done'])
+
+    def test_0030_max_pending(self):
+        self.client.send(*[Message('slow', b'', b'') for i in range(0, 6)])
+        self.run_async(asyncio.sleep(0.05, loop=self.loop))
+        handler, = self.server._connections
+        self.assertTrue(handler.reading_paused)
+        self.server.handlers['slow'].release.set()
+        self.expect(6)
+        self.assertFalse(handler.reading_paused)
+        self.assertIsNone(handler.backlog)
+
+if __name__ == '__main__':
+    unittest.main()
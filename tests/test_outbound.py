@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+
+import asyncirc
+from asyncirc import outbound
+from asyncirc.message import Broadcast, ClientMsg, Message, RoomMsgd, \
+        ServerBusy
+
+class TestLanes(unittest.TestCase):
+
+    def test_00_priority(self):
+        self.assertEqual(outbound.priority(RoomMsgd), outbound.CONTROL)
+        self.assertEqual(outbound.priority(ClientMsg('a', 'b')),
+                outbound.DIRECT)
+        self.assertEqual(outbound.priority(Broadcast('a', 'b', b'c')),
+                outbound.BROADCAST)
+        # Refused listings stay in order with the listings sent before them
+        self.assertEqual(outbound.priority(ServerBusy('room_members')),
+                outbound.BULK)
+        self.assertEqual(outbound.priority(ServerBusy('msg_room')),
+                outbound.CONTROL)
+        self.assertEqual(outbound.priority(ServerBusy()), outbound.CONTROL)
+
+    def test_01_weighted(self):
+        lanes = outbound.Lanes()
+        payload = b'x' * (outbound.QUANTUM - 64)
+        for i in range(0, 8):
+            lanes.push(Message('bulk', b'', payload), outbound.BULK)
+            lanes.push(Message('broadcast', b'', payload), outbound.BROADCAST)
+        lanes.push(RoomMsgd, outbound.CONTROL)
+        written = []
+        self.assertTrue(lanes.drain(lambda msg, lane, enqueued:
+            written.append(msg.handler) or True))
+        self.assertEqual(lanes.size, 0)
+        self.assertEqual(written[:4], ['room_msgd', 'broadcast', 'broadcast',
+            'bulk'])
+        self.assertEqual(len(written), 17)
+
+    def test_02_paused(self):
+        lanes = outbound.Lanes()
+        lanes.push(RoomMsgd, outbound.CONTROL)
+        lanes.push(RoomMsgd, outbound.CONTROL)
+        self.assertFalse(lanes.drain(lambda msg, lane, enqueued: False))
+        self.assertEqual(len(lanes), 1)
+
+class TestPriority(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server()
+        self.client = asyncirc.client.Client.create_loopback(self.server,
+                loop=self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.disconnect())
+        self.loop.close()
+
+    def test_00_acks_overtake_broadcasts(self):
+        received = []
+        self.client.add_handler('handle_broadcast', lambda client, msg:
+            received.append(msg.handler))
+        self.loop.run_until_complete(self.client.identify('test_client'))
+        self.loop.run_until_complete(self.client.join_room('test_room'))
+        handler, = self.server._connections
+        handler.transport.set_write_buffer_limits(high=1024)
+        self.client.sock.pause_reading()
+        payload = b'x' * 512
+        for i in range(0, 16):
+            self.server._rooms['test_room'].broadcast(handler,
+                    Message('msg_room', b'test_room', payload))
+        self.assertTrue(handler.writing_paused)
+        queued = len(handler.lanes)
+        handler.send(RoomMsgd)
+        self.client.add_handler('handle_room_msgd', lambda client, msg:
+            received.append(msg.handler))
+        self.client.sock.resume_reading()
+        self.loop.run_until_complete(self.client.echo('flush'))
+        # Broadcasts already in the transport come first, then the ack
+        self.assertEqual(received.index('room_msgd'), 16 - queued)
+        self.assertIsNone(handler.lanes)
+        self.assertEqual(self.server.metrics.gauges['outbound.queued'], 0)
+        timing = self.server.metrics.timings['outbound.control.latency']
+        self.assertGreater(timing.max, 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+
+import asyncirc
+
+class TestOverload(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            self.run_async(client.disconnect())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.server.shutdown()
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro,
+            10.0, loop=self.loop))
+
+    def start(self, **kwds):
+        self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                loop=self.loop, **kwds)
+
+    def connect(self, name=None):
+        client = asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop)
+        self.clients.append(client)
+        if name is not None:
+            self.run_async(client.identify(name))
+        return client
+
+    def refused(self, client):
+        self.run_async(client.disconnected)
+        self.clients.remove(client)
+
+    def test_0000_max_connections(self):
+        self.start(max_connections=1)
+        self.connect('test_client')
+        self.refused(self.connect())
+        self.assertEqual(self.server.metrics.counters['shed.connections'], 1)
+        self.assertEqual(self.server.metrics.gauges['connections'], 1)
+
+    def test_0010_max_unidentified(self):
+        self.start(max_unidentified=1)
+        client = self.connect()
+        self.run_async(client.echo('Hello'))
+        self.refused(self.connect())
+        self.assertEqual(self.server.metrics.counters['shed.unidentified'], 1)
+        self.run_async(client.identify('test_client'))
+        self.connect('other_client')
+        self.assertEqual(len(self.server._unidentified), 0)
+
+    def test_0020_identify_deadline(self):
+        self.start(identify_deadline=0.05)
+        client = self.connect('test_client')
+        self.refused(self.connect())
+        self.assertEqual(
+                self.server.metrics.counters['shed.identify_deadline'], 1)
+        self.assertEqual(self.run_async(client.echo('Hello')), 'Hello')
+
+    def test_0030_shed_buffered(self):
+        self.start(shed_buffered=0)
+        client = self.connect('test_client')
+        self.run_async(client.join_room('test_room'))
+        self.assertEqual(self.run_async(client.msg_room('test_room',
+            'Hello')), 'server busy')
+        self.assertIsNone(self.run_async(client.list_rooms()))
+        self.assertIsNone(self.run_async(client.room_members('test_room')))
+        self.assertIsNone(self.run_async(client.msg_client('test_client',
+            'Hello')))
+        self.assertEqual(self.server.metrics.counters['shed.msg_room'], 1)
+        self.assertEqual(self.server.metrics.counters['shed.list_rooms'], 1)
+        self.assertEqual(self.server.metrics.counters['shed.room_members'],
+                1)
+
+    def test_0031_shed_transport_buffered(self):
+        self.start(shed_buffered=1024)
+        client = asyncirc.client.Client.create_loopback(self.server,
+                loop=self.loop)
+        self.clients.append(client)
+        self.run_async(client.identify('test_client'))
+        # Replies wait in the server's transport buffer, not in its lanes
+        client.transport.pause_reading()
+        for i in range(0, 4):
+            client.send(asyncirc.message.Echo('x' * 512))
+        self.run_async(asyncio.sleep(0.01, loop=self.loop))
+        self.assertFalse(self.server.metrics.gauges.get('outbound.queued'))
+        other = self.connect('other_client')
+        self.assertIsNone(self.run_async(other.list_rooms()))
+        self.assertGreaterEqual(self.server.metrics.gauges['outbound.buffered'],
+                4 * 512)
+        client.transport.resume_reading()
+        client.add_handler('handle_echo', lambda client, msg: None)
+
+    def test_0040_shed_lag(self):
+        self.start(shed_lag=0.5)
+        client = self.connect('test_client')
+        self.run_async(client.create_room('test_room'))
+        self.assertEqual(self.run_async(client.list_rooms()), 'test_room')
+        self.server.monitor.lag = 1.0
+        self.assertIsNone(self.run_async(client.list_rooms()))
+        self.server.monitor.lag = 0.0
+        self.assertEqual(self.run_async(client.list_rooms()), 'test_room')
+
+if __name__ == '__main__':
+    unittest.main()
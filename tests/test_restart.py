@@ -0,0 +1,133 @@
+import os
+import socket
+import asyncio
+import unittest
+import tempfile
+
+import asyncirc
+from asyncirc import restart
+
+class TestRestart(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                loop=self.loop)
+        self.client = self.connect(self.server)
+
+    def tearDown(self):
+        if not self.client.disconnected.done():
+            self.run_async(self.client.disconnect())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        self.tempdir.cleanup()
+
+    def connect(self, server):
+        return asyncirc.client.Client.create_connection('127.0.0.1',
+                port=server.port, loop=self.loop)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro,
+            1.0, loop=self.loop))
+
+    def path(self, name):
+        return os.path.join(self.tempdir.name, name)
+
+    def test_0000_snapshot(self):
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        self.run_async(self.client.create_room('empty_room'))
+        restart.snapshot(self.server, self.path('snapshot'))
+        self.assertEqual(os.stat(self.path('snapshot')).st_mode & 0o777,
+                0o600)
+        server = asyncirc.server.Server()
+        self.assertTrue(restart.restore(server, self.path('snapshot')))
+        self.assertEqual(list(server._rooms), ['test_room', 'empty_room'])
+        self.assertEqual(server._rooms['test_room'].clients(), [])
+        self.assertEqual(server._restored, {'test_client': ['test_room']})
+
+    def test_0001_restored_member_rejoins(self):
+        server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                loop=self.loop)
+        server.restore_member('test_client', 'test_room')
+        client = self.connect(server)
+        self.run_async(client.identify('test_client'))
+        self.assertEqual(server._rooms['test_room'].clients(),
+                ['test_client'])
+        self.run_async(client.disconnect())
+        server.close()
+
+    def test_0002_admin_credentials_kept(self):
+        self.server._credentials['admin'] = (b'0' * 16, b'1' * 32)
+        restart.snapshot(self.server, self.path('snapshot'))
+        server = asyncirc.server.Server(admins={'admin': b'secret'},
+                kdf_iterations=1000)
+        credentials = server._credentials['admin']
+        restart.restore(server, self.path('snapshot'))
+        self.assertEqual(server._credentials['admin'], credentials)
+
+    def test_0010_send_fds(self):
+        left, right = socket.socketpair()
+        with left, right, open(self.path('fd'), 'w') as fd:
+            restart.send_fds(left, b'fds', [fd.fileno()])
+            data, fds = restart.recv_fds(right, 1024)
+            self.assertEqual(data, b'fds')
+            self.assertEqual(len(fds), 1)
+            os.close(fds[0])
+
+    def test_0020_handoff(self):
+        self.run_async(self.client.identify('test_client'))
+        self.run_async(self.client.join_room('test_room'))
+        handoff = restart.Handoff(self.server, self.path('handoff'),
+                drain_timeout=1.0, loop=self.loop)
+        handoff.listen()
+        socks, snapshot = self.run_async(self.loop.run_in_executor(None,
+            restart.takeover, self.path('handoff')))
+        server = asyncirc.server.Server.start(socks=socks, loop=self.loop)
+        self.assertTrue(restart.restore(server, snapshot))
+        self.assertEqual(server.port, self.server.port)
+        # The old server still serves its clients while draining
+        self.run_async(asyncio.sleep(0.05, loop=self.loop))
+        self.assertTrue(handoff.handed_off)
+        self.assertFalse(self.server._sock.sockets)
+        self.run_async(self.client.echo('Still here'))
+        self.run_async(self.client.disconnect())
+        self.run_async(handoff.done)
+        # Reconnecting lands on the new server, back in its rooms
+        self.client = self.connect(server)
+        self.run_async(self.client.identify('test_client'))
+        self.assertEqual(server._rooms['test_room'].clients(),
+                ['test_client'])
+        self.run_async(self.client.disconnect())
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+    def test_0021_takeover_nothing_running(self):
+        self.assertIsNone(restart.takeover(self.path('handoff')))
+
+    def test_0022_handoff_other_user(self):
+        class Untrusted(restart.Handoff):
+            def trusted(self, conn):
+                return False
+        handoff = Untrusted(self.server, self.path('handoff'), loop=self.loop)
+        handoff.listen()
+        self.assertEqual(os.stat(self.path('handoff')).st_mode & 0o777, 0o600)
+        with self.assertRaises(ConnectionResetError):
+            self.run_async(self.loop.run_in_executor(None, restart.takeover,
+                self.path('handoff')))
+        # Still listening for a handoff and serving
+        self.assertFalse(handoff.handed_off)
+        self.assertTrue(os.path.exists(self.path('handoff')))
+        self.assertFalse(os.path.exists(handoff.snapshot))
+        self.run_async(self.client.echo('Still here'))
+        handoff.close()
+
+    def test_0023_same_user(self):
+        left, right = socket.socketpair()
+        with left, right:
+            self.assertTrue(restart.same_user(left))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import asyncio
+import unittest
+import tempfile
+
+import asyncirc
+
+from tests import test_irc
+
+class TestIRCUnix(test_irc.TestIRC):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'asyncirc.sock')
+        self.loop = asyncio.new_event_loop()
+        self.server = asyncirc.server.Server.start(port=None, unix=self.path,
+                loop=self.loop)
+        self.client = self.connect()
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.tempdir.cleanup()
+
+    def connect(self):
+        return asyncirc.client.Client.create_connection(unix=self.path,
+                loop=self.loop)
+
+@unittest.skipUnless(sys.platform.startswith('linux'),
+        'abstract namespace is linux only')
+class TestIRCAbstractUnix(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.path = '@asyncirc-test-%d' % (os.getpid())
+        self.server = asyncirc.server.Server.start(addr='127.0.0.1', port=0,
+                unix=[self.path], loop=self.loop)
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def test_0000_multiple_endpoints(self):
+        clients = [
+            asyncirc.client.Client.create_connection('127.0.0.1',
+                port=self.server.port, loop=self.loop),
+            asyncirc.client.Client.create_connection(unix=self.path,
+                loop=self.loop),
+            ]
+        for client in clients:
+            self.loop.run_until_complete(client.echo('Hello World!'))
+            self.loop.run_until_complete(client.disconnect())
+
+if __name__ == '__main__':
+    unittest.main()